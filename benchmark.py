@@ -0,0 +1,476 @@
+import argparse
+import concurrent.futures
+import contextlib
+import http.server
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+import html2markdown
+from merge_markdown import process_markdown_file as merge_entry_from_file, write_merged_entries
+from optimize_markdown import optimize_date, process_markdown_file as optimize_file
+from text_reader import read_text
+from uploaders import MultipartPostUploader, S3Uploader
+
+# This script measures the throughput of the migration pipeline on a synthetic
+# Wiz export. It generates a corpus that looks like a wiz-export output (nested
+# folders, one <title>/index.html per note, the "My Diary" date header that
+# optimize_markdown.optimize_date rewrites, and local images under index_files/),
+# then times each stage separately:
+#   convert   html2markdown.convert_html_to_markdown on every note
+#   upload    the image upload stage, with a stub uploader instead of uPic, or with
+#             --uploader post|s3 the real HTTP uploaders against a local stand-in server
+#   optimize  optimize_markdown.process_markdown_file on every Markdown file
+#   merge     merge_markdown streaming every Markdown file into merged_result.txt
+# For each stage it reports files/sec, MB/sec and the peak RSS of the process so far.
+#
+# With --compare-converters it instead converts every note (and the FIDELITY_SAMPLES
+# below) with each html2markdown converter backend, reports the throughput of each,
+# and lists the notes whose Markdown differs beyond blank lines and trailing spaces.
+# It exits with status 1 if any note differs, so it can be used as a fidelity check.
+#
+# Usage: python benchmark.py [--notes N] [--images-per-note N] [--jobs N] [--converter NAME] [--corpus DIR] [--json FILE]
+#        python benchmark.py --compare-converters [--corpus DIR]
+
+WEEKDAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+WORDS = ["wiz", "note", "diary", "migration", "day", "one", "markdown", "export", "今天", "天气", "工作", "读书", "笔记", "记录"]
+FOLDER_NAMES = ["My Notes", "Work", "Reading", "Travel", "Projects", "Archive", "Clips", "Ideas"]
+
+# Empty <em> elements are what html2text turns into the "____" and "* __" lines of a Wiz diary header
+DIARY_HEADER = (
+    "<div><p>{day:02d}</p><p>{month:02d}</p><p>{weekday}</p><p><em></em><em></em></p>"
+    "<ul>" + "<li><em></em></li>" * 4 + "</ul><ul>" + "<li><em></em></li>" * 4 + "</ul></div>"
+)
+
+
+# Hand-written Wiz HTML covering what the synthetic notes do not, for --compare-converters
+FIDELITY_SAMPLES = {
+    "sample/diary_header": DIARY_HEADER.format(day=5, month=3, weekday="星期三") + "<h1>Title</h1><p>text</p>",
+    "sample/inline": '<p>a <b>bold</b> <i>it</i> <strong>s</strong> <em>e</em> <a href="https://x.com/1">link</a> '
+                     '<code>c</code><br>next line</p><p>2. not a list * star _u_ [b] # hash</p>',
+    "sample/lists": "<ul><li>one</li><li>two<ul><li>nested</li></ul></li></ul><ol><li>first</li><li>second</li></ol>",
+    # The Wiz editor and web clips wrap list item content in <div> and <p>
+    "sample/block_lists": "<ul><li><div>first item</div></li><li><div>second <b>item</b></div><ul><li><div>nested</div></li></ul></li></ul>"
+                          "<ol><li><p>one</p></li><li><p>two</p><p>second paragraph</p></li></ol><p>after</p>",
+    "sample/nested_quotes": "<blockquote><p>outer</p><blockquote><p>inner</p><p>inner two</p></blockquote><p>back</p></blockquote>",
+    "sample/definitions": "<dl><dt>term</dt><dd>definition</dd><dt>second term</dt><dd>second definition</dd></dl><p>after</p>",
+    "sample/tables": "<table><tr><th>h1</th><th>h2</th></tr><tr><td>a</td><td>b <b>c</b></td></tr></table>"
+                     "<table><tr><td>x</td><td>y</td></tr></table>",
+    # Layout tables of old web clips nest tables in cells; html2text continues the outer rows
+    "sample/nested_tables": "<table><tr><td>a</td><td>b</td></tr><tr><td>x<table><tr><td>in</td><td>2</td></tr>"
+                            "<tr><td>r</td></tr></table>y</td><td>c</td></tr></table>"
+                            "<table><tbody><tr><td><table><tr><td>menu</td></tr><tr><td>item <b>one</b></td></tr></table></td>"
+                            "<td>body</td></tr></tbody></table><p>after</p>",
+    "sample/numbering": '<ol start="3"><li>third</li><li>fourth</li></ol><p>press <kbd>Ctrl</kbd> and <tt>t</tt></p>',
+    "sample/blocks": "<blockquote><p>quoted</p><p>two</p></blockquote><pre>code\n  line</pre><hr>"
+                     "<div>div text<div>inner</div></div>",
+    "sample/images": '<p><img src="index_files/a.png" alt="x"></p><img src="b.jpg"><h2>Sub <b>b</b></h2>text after<span> span</span>',
+    "sample/entities": "<p>a&amp;b &lt;tag&gt; &nbsp;x</p><p>   multiple    spaces\n newline</p>"
+                       "<script>bad()</script><style>.x{}</style>",
+    "sample/web_clip": '<html><head><meta charset="utf-8"><title>clip</title></head><body><div class="article">'
+                       "<h3>Heading</h3><p>First <span style=\"color:red\">red</span> paragraph.</p>"
+                       '<div><p>Nested <a href="http://example.com/?a=1&amp;b=2">query link</a></p></div></div></body></html>',
+}
+
+
+def _sentence(rng, word_count):
+    return " ".join(rng.choice(WORDS) for _ in range(word_count))
+
+
+def _note_html(rng, title, diary, paragraphs, image_names):
+    """Builds the HTML of one synthetic note."""
+    body = []
+    if diary:
+        body.append(DIARY_HEADER.format(day=rng.randint(1, 28), month=rng.randint(1, 12), weekday=rng.choice(WEEKDAYS)))
+    body.append(f"<h1>{title}</h1>")
+    for i in range(paragraphs):
+        kind = rng.random()
+        if kind < 0.1:
+            items = "".join(f"<li>{_sentence(rng, 6)}</li>" for _ in range(rng.randint(2, 6)))
+            body.append(f"<ul>{items}</ul>")
+        elif kind < 0.15:
+            rows = "".join(
+                "<tr>" + "".join(f"<td>{_sentence(rng, 2)}</td>" for _ in range(4)) + "</tr>"
+                for _ in range(rng.randint(2, 8))
+            )
+            body.append(f"<table>{rows}</table>")
+        else:
+            body.append(f"<p>{_sentence(rng, rng.randint(10, 60))} <b>{_sentence(rng, 2)}</b> <a href=\"https://example.com/{i}\">link</a></p>")
+    for image_name in image_names:
+        body.append(f'<p><img src="index_files/{image_name}"></p>')
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{}</title></head><body>{}</body></html>"
+    ).format(title, "\n".join(body))
+
+
+def generate_corpus(root, notes=1000, images_per_note=2, unique_images=200, image_size=50 * 1024,
+                    diary_ratio=0.3, paragraphs=20, max_depth=3, seed=0):
+    """
+    Generates a synthetic Wiz export under root and returns a dict describing it.
+    Images are drawn from a pool of unique_images contents, so the upload stage sees
+    repeated images under different paths the way real exports do.
+    """
+    rng = random.Random(seed)
+    image_pool = [rng.randbytes(image_size) for _ in range(unique_images)] if images_per_note else []
+    total_bytes = 0
+    image_count = 0
+
+    for note_index in range(notes):
+        diary = rng.random() < diary_ratio
+        if diary:
+            folder = os.path.join("My Diary", str(rng.randint(2012, 2020)))
+        else:
+            depth = rng.randint(1, max_depth)
+            folder = os.path.join(*(rng.choice(FOLDER_NAMES) for _ in range(depth)))
+        title = f"{_sentence(rng, 3)} {note_index}"
+        note_dir = os.path.join(root, folder, title)
+        os.makedirs(note_dir, exist_ok=True)
+
+        image_names = []
+        if image_pool:
+            os.makedirs(os.path.join(note_dir, "index_files"), exist_ok=True)
+            for i in range(images_per_note):
+                image_name = f"image{i}.png"
+                with open(os.path.join(note_dir, "index_files", image_name), 'wb') as f:
+                    f.write(rng.choice(image_pool))
+                image_names.append(image_name)
+                image_count += 1
+
+        html = _note_html(rng, title, diary, paragraphs, image_names).encode('utf-8')
+        with open(os.path.join(note_dir, "index.html"), 'wb') as f:
+            f.write(html)
+        total_bytes += len(html)
+
+    return {"notes": notes, "html_bytes": total_bytes, "images": image_count, "unique_images": len(image_pool)}
+
+
+def make_stub_uploader(latency=0.0):
+    """Returns an uploader standing in for uPic: waits latency seconds and returns a fake URL."""
+    def stub_upload(local_image_path):
+        if latency:
+            time.sleep(latency)
+        return "https://images.example.com/" + os.path.basename(local_image_path)
+    return stub_upload
+
+
+class _UploadHandler(http.server.BaseHTTPRequestHandler):
+    """Accepts S3-style PUTs and multipart POSTs, like an image host would."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse by the uploaders shows
+    disable_nagle_algorithm = True  # Headers and body are written separately
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _receive(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.uploads += 1
+            self.server.upload_bytes += len(body)
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        self._receive()
+        signed = self.headers.get("Authorization", "").startswith("AWS4-HMAC-SHA256 ")
+        self._reply(200 if signed else 403)
+
+    def do_POST(self):
+        self._receive()
+        url = f"https://images.example.com/{self.server.uploads}"
+        self._reply(200, json.dumps({"data": {"url": url}}).encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalUploadServer:
+    """A local HTTP server standing in for S3 or an image host, counting uploads and connections."""
+
+    def __init__(self, latency=0.0):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _UploadHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.latency = latency
+        self.server.connections = self.server.uploads = self.server.upload_bytes = 0
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def make_uploader(self, kind):
+        if kind == "s3":
+            return S3Uploader(self.url + "/bucket", "BENCHMARKKEY", "benchmark-secret")
+        return MultipartPostUploader(self.url + "/upload", url_field="data.url")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def print_summary(self):
+        print(f"Local upload server: {self.server.uploads} uploads "
+              f"({self.server.upload_bytes / (1024 * 1024):.1f} MiB) over {self.server.connections} connections.")
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MiB, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class StageTimer:
+    """Collects the results of the timed stages."""
+
+    def __init__(self):
+        self.results = []
+
+    @contextlib.contextmanager
+    def stage(self, name, files, size_bytes):
+        # Per-file progress output is discarded so the console does not dominate the measurement
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            yield
+            seconds = time.perf_counter() - start
+        self.results.append({
+            "stage": name,
+            "files": files,
+            "bytes": size_bytes,
+            "seconds": seconds,
+            "files_per_sec": files / seconds if seconds else None,
+            "mb_per_sec": size_bytes / (1024 * 1024) / seconds if seconds else None,
+            "peak_rss_mb": peak_rss_mb(),
+        })
+
+    def print_report(self):
+        print(f"{'stage':<10} {'files':>8} {'MB':>9} {'seconds':>9} {'files/s':>10} {'MB/s':>8} {'peak RSS MB':>12}")
+        for r in self.results:
+            files_per_sec = f"{r['files_per_sec']:.1f}" if r['files_per_sec'] is not None else "-"
+            mb_per_sec = f"{r['mb_per_sec']:.2f}" if r['mb_per_sec'] is not None else "-"
+            rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else "-"
+            print(f"{r['stage']:<10} {r['files']:>8} {r['bytes'] / (1024 * 1024):>9.2f} {r['seconds']:>9.3f} "
+                  f"{files_per_sec:>10} {mb_per_sec:>8} {rss:>12}")
+
+
+def _total_size(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def normalize_markdown(markdown):
+    """Drops trailing spaces, empty quote lines and repeated blank lines, which Markdown renders the same."""
+    lines = [line.rstrip() for line in markdown.splitlines()]
+    lines = ["" if line == ">" else line for line in lines]
+    normalized = []
+    for line in lines:
+        if line or (normalized and normalized[-1]):
+            normalized.append(line)
+    return "\n".join(normalized).strip("\n")
+
+
+def _first_difference(expected, actual):
+    """Returns (line number, expected line, actual line) of the first differing line."""
+    expected_lines, actual_lines = expected.split("\n"), actual.split("\n")
+    for number, (expected_line, actual_line) in enumerate(zip(expected_lines, actual_lines), start=1):
+        if expected_line != actual_line:
+            return number, expected_line, actual_line
+    number = min(len(expected_lines), len(actual_lines)) + 1
+    return number, "\n".join(expected_lines[number - 1:number]), "\n".join(actual_lines[number - 1:number])
+
+
+def compare_converters(corpus_dir, backends=html2markdown.CONVERTER_BACKENDS, max_reported=10):
+    """
+    Converts every note of the corpus and every FIDELITY_SAMPLES entry with each backend.
+    Prints the throughput of each backend and the documents whose normalized Markdown
+    differs from the first backend's. Returns (StageTimer, number of differing documents).
+    """
+    documents = dict(FIDELITY_SAMPLES)
+    for input_path, _ in html2markdown.find_html_files(corpus_dir, os.path.join(corpus_dir, html2markdown.OUTPUT_DIR_NAME)):
+        documents[os.path.relpath(input_path, corpus_dir)] = read_text(input_path, html=True)
+    total_bytes = sum(len(html.encode('utf-8')) for html in documents.values())
+
+    timer = StageTimer()
+    outputs = {}
+    for backend in backends:
+        converter = html2markdown.create_converter(backend)
+        with timer.stage(backend, len(documents), total_bytes):
+            outputs[backend] = {name: converter.handle(html) for name, html in documents.items()}
+
+    reference = backends[0]
+    differing = 0
+    for backend in backends[1:]:
+        identical = equivalent = 0
+        diaries = {reference: 0, backend: 0}
+        reported = []
+        for name in documents:
+            expected, actual = outputs[reference][name], outputs[backend][name]
+            for which, markdown in ((reference, expected), (backend, actual)):
+                diaries[which] += optimize_date(markdown)[1]
+            if expected == actual:
+                identical += 1
+                continue
+            expected, actual = normalize_markdown(expected), normalize_markdown(actual)
+            if expected == actual:
+                equivalent += 1
+                continue
+            differing += 1
+            if len(reported) < max_reported:
+                reported.append((name, _first_difference(expected, actual)))
+        print(f"{backend} vs {reference}: {identical} identical, {equivalent} equal after whitespace normalization, "
+              f"{len(documents) - identical - equivalent} different; diary headers found "
+              f"{diaries[backend]} vs {diaries[reference]}")
+        for name, (line_number, expected_line, actual_line) in reported:
+            print(f"  {name}, line {line_number}:\n    {reference}: {expected_line!r}\n    {backend}: {actual_line!r}")
+        if diaries[backend] != diaries[reference]:
+            differing += 1
+    return timer, differing
+
+
+def run_benchmark(corpus_dir, jobs=1, upload_workers=html2markdown.DEFAULT_UPLOAD_WORKERS, upload_latency=0.0,
+                  converter_backend=html2markdown.DEFAULT_CONVERTER, uploader_kind="stub"):
+    """
+    Runs every stage on the corpus and returns the StageTimer with the results.
+    uploader_kind is "stub", or "post"/"s3" to upload to a LocalUploadServer.
+    """
+    timer = StageTimer()
+    output_dir = os.path.join(corpus_dir, html2markdown.OUTPUT_DIR_NAME)
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+
+    tasks = html2markdown.find_html_files(corpus_dir, output_dir)
+    html_bytes = _total_size(input_path for input_path, _ in tasks)
+
+    with timer.stage("convert", len(tasks), html_bytes):
+        if jobs > 1:
+            chunksize = max(1, len(tasks) // (jobs * 8))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=html2markdown._init_worker,
+                                                        initargs=(True, False, converter_backend)) as executor:
+                converted_notes = [note[:3] for note in executor.map(html2markdown._convert_worker, tasks, chunksize=chunksize)]
+        else:
+            converter = html2markdown.create_converter(converter_backend)
+            converted_notes = [
+                (input_path, output_path, html2markdown.convert_html_to_markdown(input_path, output_path, converter))
+                for input_path, output_path in tasks
+            ]
+
+    image_paths = {image_path for _, _, paths in converted_notes if paths for image_path in paths}
+    server = None
+    if uploader_kind == "stub":
+        uploader = make_stub_uploader(upload_latency)
+    else:
+        server = LocalUploadServer(upload_latency)
+        uploader = server.make_uploader(uploader_kind)
+    try:
+        with timer.stage("upload", len(image_paths), _total_size(image_paths)):
+            html2markdown.upload_and_rewrite_images(converted_notes, upload_workers=upload_workers, uploader=uploader)
+    finally:
+        if server is not None:
+            server.close()
+            server.print_summary()
+
+    markdown_paths = [output_path for _, output_path in tasks]
+    markdown_bytes = _total_size(markdown_paths)
+    with timer.stage("optimize", len(markdown_paths), markdown_bytes):
+        for markdown_path in markdown_paths:
+            optimize_file(markdown_path)
+
+    markdown_bytes = _total_size(markdown_paths)
+    with timer.stage("merge", len(markdown_paths), markdown_bytes):
+        write_merged_entries((merge_entry_from_file(path) for path in markdown_paths), output_dir)
+
+    return timer
+
+
+def main():
+    """Main function to parse arguments, generate the corpus and run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark the Wiz to Day One pipeline on a synthetic Wiz export.")
+    parser.add_argument("--corpus", default=None,
+                        help="Directory of the synthetic export. Generated if missing or empty; a temporary directory is used if omitted.")
+    parser.add_argument("--generate-only", action="store_true", help="Only generate the corpus (requires --corpus).")
+    parser.add_argument("--notes", type=int, default=1000, help="Number of notes to generate (default: 1000).")
+    parser.add_argument("--images-per-note", type=int, default=2, help="Local images per note (default: 2).")
+    parser.add_argument("--unique-images", type=int, default=200, help="Number of distinct image contents (default: 200).")
+    parser.add_argument("--image-size", type=int, default=50 * 1024, help="Size of each image in bytes (default: 51200).")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per note (default: 20).")
+    parser.add_argument("--diary-ratio", type=float, default=0.3, help="Fraction of notes with a diary date header (default: 0.3).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the corpus (default: 0).")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes for the convert stage (default: 1).")
+    parser.add_argument("--upload-workers", type=int, default=html2markdown.DEFAULT_UPLOAD_WORKERS,
+                        help=f"Concurrent uploads (default: {html2markdown.DEFAULT_UPLOAD_WORKERS}).")
+    parser.add_argument("--upload-latency", type=float, default=0.0,
+                        help="Simulated seconds per upload in the stub uploader or local server (default: 0).")
+    parser.add_argument("--uploader", choices=("stub", "post", "s3"), default="stub",
+                        help="Upload stage uploader: an in-process stub (default), or the HTTP uploaders "
+                             "posting to / putting into a local stand-in server.")
+    parser.add_argument("--converter", choices=html2markdown.CONVERTER_BACKENDS, default=html2markdown.DEFAULT_CONVERTER,
+                        help=f"HTML to Markdown backend of the convert stage (default: {html2markdown.DEFAULT_CONVERTER}).")
+    parser.add_argument("--compare-converters", action="store_true",
+                        help="Compare the output and throughput of all converter backends instead of running the pipeline.")
+    parser.add_argument("--json", default=None, help="Also write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    if args.generate_only and not args.corpus:
+        print("Error: --generate-only requires --corpus.", file=sys.stderr)
+        sys.exit(1)
+
+    temp_dir = None
+    corpus_dir = args.corpus
+    if corpus_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix="wiz2dayone-bench-")
+        corpus_dir = temp_dir
+    corpus_dir = os.path.abspath(corpus_dir)
+
+    try:
+        if not os.path.isdir(corpus_dir) or not os.listdir(corpus_dir):
+            print(f"Generating {args.notes} notes in: {corpus_dir}")
+            start = time.perf_counter()
+            corpus = generate_corpus(corpus_dir, notes=args.notes, images_per_note=args.images_per_note,
+                                     unique_images=args.unique_images, image_size=args.image_size,
+                                     diary_ratio=args.diary_ratio, paragraphs=args.paragraphs, seed=args.seed)
+            print(f"Generated {corpus['notes']} notes ({corpus['html_bytes'] / (1024 * 1024):.1f} MiB of HTML, "
+                  f"{corpus['images']} image references) in {time.perf_counter() - start:.1f}s.")
+        else:
+            print(f"Using existing corpus: {corpus_dir}")
+
+        if args.generate_only:
+            return
+
+        differing = 0
+        if args.compare_converters:
+            timer, differing = compare_converters(corpus_dir)
+        else:
+            timer = run_benchmark(corpus_dir, jobs=args.jobs, upload_workers=args.upload_workers,
+                                  upload_latency=args.upload_latency, converter_backend=args.converter,
+                                  uploader_kind=args.uploader)
+        timer.print_report()
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(timer.results, f, indent=2)
+            print(f"Results written to {args.json}")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    if differing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+import zipfile
+
+from merge_markdown import DEFAULT_DATE
+
+# This module writes a Day One JSON export zip, which Day One imports with
+# File > Import > Day One JSON (.zip). Unlike the plain text import, the zip carries
+# the images of every note as photo attachments, so no image has to be uploaded:
+#
+#   Journal.json          {"metadata": {...}, "entries": [{"uuid", "creationDate", "text", "photos": [...]}, ...]}
+#   photos/<md5>.<type>   one file per distinct image
+#
+# Local image links in the Markdown are replaced by dayone-moment://<identifier>
+# links to the entry's photos. Images are deduplicated by MD5 (the hash Day One uses
+# to name photo files), so an image referenced by many notes is stored once.
+# Entries are streamed to a temporary file and the photos straight into the zip, so
+# memory use does not grow with the size of the archive.
+
+JOURNAL_NAME = "Journal.json"
+EXPORT_VERSION = "1.0"
+TIME_ZONE = "Asia/Shanghai"
+UTC_OFFSET = datetime.timedelta(hours=8)  # Note dates are local times in TIME_ZONE
+
+# Photo types Day One accepts, by file extension
+PHOTO_TYPES = {
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".png": "png",
+    ".gif": "gif",
+    ".heic": "heic",
+    ".tif": "tiff",
+    ".tiff": "tiff",
+    ".webp": "webp",
+}
+
+
+def _new_identifier():
+    """Returns an identifier in Day One's format (32 uppercase hex digits)."""
+    return uuid.uuid4().hex.upper()
+
+
+def _md5_file(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_creation_date(note_date):
+    """Formats a local note date as the UTC timestamp Day One expects."""
+    return (note_date - UTC_OFFSET).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class DayOneExportWriter:
+    """Streams entries and their photos into a Day One JSON export zip."""
+
+    def __init__(self, export_path):
+        self.export_path = export_path
+        self.zip_file = zipfile.ZipFile(export_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        # zipfile allows only one open member at a time, so Journal.json is built
+        # in a temporary file and added when the export is closed
+        self.journal = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        self.journal.write('{"metadata": {"version": "%s"}, "entries": [\n' % EXPORT_VERSION)
+        self.entry_count = 0
+        self.photo_count = 0
+        self.stored_md5s = set()  # Photos already in the zip
+        self.md5_by_path = {}  # Each image file is hashed once, however often it is referenced
+
+    def _store_photo(self, image_path):
+        """Adds an image to the zip unless an identical one is there already; returns (md5, type) or None."""
+        photo_type = PHOTO_TYPES.get(os.path.splitext(image_path)[1].lower())
+        if photo_type is None:
+            print(f"Warning: Unsupported image type, keeping local link: {image_path}", file=sys.stderr)
+            return None
+        md5 = self.md5_by_path.get(image_path)
+        if md5 is None:
+            try:
+                md5 = self.md5_by_path[image_path] = _md5_file(image_path)
+            except OSError as e:
+                print(f"Warning: Could not read image {image_path}: {e}", file=sys.stderr)
+                return None
+        if md5 not in self.stored_md5s:
+            # Images are already compressed
+            self.zip_file.write(image_path, f"photos/{md5}.{photo_type}", compress_type=zipfile.ZIP_STORED)
+            self.stored_md5s.add(md5)
+        return md5, photo_type
+
+    def write_entry(self, markdown_content, image_paths=(), note_date=None, rewrite_links=None, stored_paths=None):
+        """
+        Adds one entry. image_paths are the absolute paths of the local images the note
+        references; each becomes a photo of the entry. rewrite_links(markdown, urls) is
+        called with a dict of image path -> dayone-moment:// URL to replace the links
+        (e.g. html2markdown.rewrite_image_links bound to the note's directory).
+        stored_paths (image path -> file) embeds another file instead, e.g. a resized copy.
+        """
+        photos = []
+        moment_urls = {}
+        for image_path in dict.fromkeys(image_paths):
+            stored = self._store_photo(stored_paths.get(image_path, image_path) if stored_paths else image_path)
+            if stored is None:
+                continue
+            md5, photo_type = stored
+            identifier = _new_identifier()
+            photos.append({"identifier": identifier, "md5": md5, "type": photo_type, "orderInMoment": len(photos)})
+            moment_urls[image_path] = f"dayone-moment://{identifier}"
+        if moment_urls and rewrite_links is not None:
+            markdown_content = rewrite_links(markdown_content, moment_urls)
+
+        entry = {
+            "uuid": _new_identifier(),
+            "creationDate": format_creation_date(note_date or DEFAULT_DATE),
+            "timeZone": TIME_ZONE,
+            "text": markdown_content,
+        }
+        if photos:
+            entry["photos"] = photos
+        if self.entry_count:
+            self.journal.write(",\n")
+        self.journal.write(json.dumps(entry, ensure_ascii=False))
+        self.entry_count += 1
+        self.photo_count += len(photos)
+
+    def close(self):
+        """Adds Journal.json and closes the zip."""
+        try:
+            self.journal.write("\n]}\n")
+            self.journal.seek(0)
+            info = zipfile.ZipInfo(JOURNAL_NAME, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with self.zip_file.open(info, 'w', force_zip64=True) as member:
+                with io.TextIOWrapper(member, encoding='utf-8') as out:
+                    shutil.copyfileobj(self.journal, out)
+        finally:
+            self.journal.close()
+            self.zip_file.close()
+        print(f"Wrote {self.entry_count} entries with {self.photo_count} photos "
+              f"({len(self.stored_md5s)} distinct images) to {self.export_path}")
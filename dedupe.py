@@ -0,0 +1,269 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+from text_reader import read_text
+
+# This module finds duplicate notes before they are merged (merge_markdown.py --dedupe,
+# or this script on its own). Wiz exports often contain the same note several times:
+# conflict copies, notes kept in two folders, the same page clipped twice.
+#
+# Every note is fingerprinted once:
+#   - the SHA-256 of its text with whitespace collapsed and lowercased, for exact duplicates
+#   - a MinHash signature of its byte shingles (overlapping SHINGLE_SIZE byte substrings of
+#     the UTF-8 text, which works for Chinese as well as for text with spaces), for near
+#     duplicates. One permutation hashing is used: each shingle hash is put in one of
+#     SIGNATURE_SIZE bins and the minimum per bin is kept, so a note is hashed once instead
+#     of SIGNATURE_SIZE times. Empty bins of short notes borrow the next filled bin's value.
+#
+# Near duplicate candidates are found with locality sensitive hashing: the signature is
+# cut into BANDS bands, and only notes with an identical band (same bucket) are compared,
+# so the work grows with the number of notes rather than with its square. A candidate is
+# a duplicate if the estimated Jaccard similarity of the two notes is at least the
+# threshold. With 16 bands of 8 rows, notes at 0.8 similarity become candidates with a
+# probability of about 0.95, at 0.9 almost always.
+#
+# Of each group of duplicates the longest note is kept (the one with most content), and
+# every note reported as its duplicate is at least threshold similar to the kept note.
+# Notes shorter than MIN_NEAR_DUPLICATE_SIZE only match exact duplicates, since short
+# diary entries built from the same template look alike without being the same note.
+#
+# Usage: python dedupe.py <path_to_markdown_files_directory> [--threshold 0.8] [--report FILE] [--jobs N]
+
+SHINGLE_SIZE = 12  # Bytes per shingle: four Chinese characters, or about two English words
+SIGNATURE_SIZE = 128  # MinHash bins
+BANDS = 16  # LSH bands of SIGNATURE_SIZE // BANDS rows each
+DEFAULT_THRESHOLD = 0.8  # Minimum estimated Jaccard similarity of near duplicates
+MIN_NEAR_DUPLICATE_SIZE = 256  # Bytes of normalized text below which only exact duplicates count
+REPORT_NAME = "dedupe_report.json"
+
+BIN_BITS = SIGNATURE_SIZE.bit_length() - 1
+ROWS = SIGNATURE_SIZE // BANDS
+# Added per bin of distance to a borrowed value, so it never equals a value of its own bin
+DENSIFY_OFFSET = 1 << (32 - BIN_BITS)
+EMPTY_BIN = 1 << 32  # Larger than any CRC-32
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(content):
+    """Returns the text that is compared: whitespace collapsed, lowercased."""
+    return WHITESPACE_PATTERN.sub(" ", content).strip().lower()
+
+
+def minhash_signature(data):
+    """Returns the one permutation MinHash signature (a tuple of SIGNATURE_SIZE ints) of bytes."""
+    mask = SIGNATURE_SIZE - 1
+    # Within a bin, comparing whole hashes orders them like their values (the bits above the bin)
+    bins = [EMPTY_BIN] * SIGNATURE_SIZE
+    shingle_count = max(1, len(data) - SHINGLE_SIZE + 1)
+    for shingle_hash in set(map(zlib.crc32, [data[i:i + SHINGLE_SIZE] for i in range(shingle_count)])):
+        index = shingle_hash & mask
+        if shingle_hash < bins[index]:
+            bins[index] = shingle_hash
+    values = [None if value == EMPTY_BIN else value >> BIN_BITS for value in bins]
+    # Densification: an empty bin takes the value of the next filled bin (wrapping around)
+    signature = list(values)
+    for index in range(SIGNATURE_SIZE):
+        if values[index] is None:
+            for distance in range(1, SIGNATURE_SIZE):
+                value = values[(index + distance) & mask]
+                if value is not None:
+                    signature[index] = value + distance * DENSIFY_OFFSET
+                    break
+    return tuple(signature)
+
+
+def estimated_similarity(signature_a, signature_b):
+    """Estimates the Jaccard similarity of two notes from their signatures."""
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / SIGNATURE_SIZE
+
+
+def fingerprint_note(file_path):
+    """
+    Returns (file_path, size, sha256, signature) of a note; size is the byte length of the
+    normalized text, signature is None for notes too short for near duplicate detection.
+    Returns None if the note cannot be read.
+    """
+    try:
+        content = read_text(file_path)
+    except (IOError, OSError) as e:
+        print(f"Warning: Could not read {file_path} for deduplication: {e}", file=sys.stderr)
+        return None
+    data = normalize_text(content).encode('utf-8')
+    signature = minhash_signature(data) if len(data) >= MIN_NEAR_DUPLICATE_SIZE else None
+    return file_path, len(data), hashlib.sha256(data).hexdigest(), signature
+
+
+class _DisjointSet:
+    """Union-find over note indices."""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def find_duplicates(markdown_files, threshold=DEFAULT_THRESHOLD, jobs=1):
+    """
+    Finds exact and near duplicates among markdown_files.
+    Returns a list of groups (kept_path, [(duplicate_path, similarity, exact), ...]), one per
+    set of duplicates, in the order of markdown_files.
+    """
+    start = time.perf_counter()
+    if jobs > 1 and len(markdown_files) > 1:
+        chunksize = max(1, len(markdown_files) // (jobs * 8))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            fingerprints = list(executor.map(fingerprint_note, markdown_files, chunksize=chunksize))
+    else:
+        fingerprints = [fingerprint_note(file_path) for file_path in markdown_files]
+    fingerprints = [fingerprint for fingerprint in fingerprints if fingerprint is not None]
+    notes = _DisjointSet(len(fingerprints))
+
+    # Exact duplicates: same normalized text
+    first_with_hash = {}
+    for index, (_, _, content_hash, _) in enumerate(fingerprints):
+        notes.union(first_with_hash.setdefault(content_hash, index), index)
+
+    # Near duplicates: one note per exact group goes into the LSH buckets
+    buckets = {}
+    for index in first_with_hash.values():
+        signature = fingerprints[index][3]
+        if signature is None:
+            continue
+        for band in range(BANDS):
+            buckets.setdefault((band, signature[band * ROWS:(band + 1) * ROWS]), []).append(index)
+
+    comparisons = 0
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        # Each member is compared with the first note of every group seen in this bucket,
+        # so a bucket costs linear time as long as it holds few distinct notes
+        leaders = []
+        for index in members:
+            for leader in leaders:
+                if notes.find(index) == notes.find(leader):
+                    break
+                comparisons += 1
+                if estimated_similarity(fingerprints[index][3], fingerprints[leader][3]) >= threshold:
+                    notes.union(leader, index)
+                    break
+            else:
+                leaders.append(index)
+
+    groups = {}
+    for index in range(len(fingerprints)):
+        groups.setdefault(notes.find(index), []).append(index)
+
+    duplicate_groups = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        # Keep the note with the most content; on a tie the shortest path, as conflict
+        # copies get a longer name ("note (1).md"), then the first one in file order
+        members.sort(key=lambda index: (-fingerprints[index][1], len(fingerprints[index][0]), index))
+        # Notes joined through a chain of edits (A~B, B~C) can be far apart, so a note is
+        # only a duplicate of the kept note it is itself similar to; the others are
+        # grouped around the next note kept
+        while len(members) > 1:
+            kept, members = members[0], members[1:]
+            _, _, kept_hash, kept_signature = fingerprints[kept]
+            duplicates, remaining = [], []
+            for index in members:
+                path, _, content_hash, signature = fingerprints[index]
+                exact = content_hash == kept_hash
+                similarity = 1.0 if exact else estimated_similarity(signature, kept_signature)
+                if exact or similarity >= threshold:
+                    duplicates.append((path, similarity, exact))
+                else:
+                    remaining.append(index)
+            if duplicates:
+                duplicate_groups.append((kept, fingerprints[kept][0], duplicates))
+            members = remaining
+    duplicate_groups = [(kept_path, duplicates) for _, kept_path, duplicates in sorted(duplicate_groups)]
+
+    duplicate_count = sum(len(duplicates) for _, duplicates in duplicate_groups)
+    exact_count = sum(exact for _, duplicates in duplicate_groups for _, _, exact in duplicates)
+    print(f"Deduplication: {duplicate_count} duplicates ({exact_count} exact, {duplicate_count - exact_count} near) "
+          f"of {len(fingerprints)} notes in {len(duplicate_groups)} groups, {comparisons} comparisons, "
+          f"{time.perf_counter() - start:.1f}s.")
+    return duplicate_groups
+
+
+def duplicate_map(duplicate_groups):
+    """Returns {duplicate_path: (kept_path, similarity, exact)} for the groups of find_duplicates."""
+    return {path: (kept, similarity, exact)
+            for kept, duplicates in duplicate_groups for path, similarity, exact in duplicates}
+
+
+def write_report(report_path, duplicate_groups, root_dir, threshold):
+    """Writes the duplicate groups as JSON, with paths relative to root_dir."""
+    report = {
+        "threshold": threshold,
+        "duplicates": sum(len(duplicates) for _, duplicates in duplicate_groups),
+        "groups": [
+            {
+                "kept": os.path.relpath(kept, root_dir),
+                "duplicates": [
+                    {"path": os.path.relpath(path, root_dir), "similarity": round(similarity, 3), "exact": exact}
+                    for path, similarity, exact in sorted(duplicates, key=lambda duplicate: -duplicate[1])
+                ],
+            }
+            for kept, duplicates in duplicate_groups
+        ],
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"Duplicate report written to {report_path}")
+
+
+def main():
+    """Main function to parse arguments and report duplicate notes."""
+    # Imported here, merge_markdown imports this module
+    from merge_markdown import find_markdown_files
+
+    parser = argparse.ArgumentParser(
+        description="Find exact and near duplicate markdown notes and write a report ({}).".format(REPORT_NAME)
+    )
+    parser.add_argument("directory_path", help="Path to the directory containing Markdown files.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Minimum similarity (0-1) of near duplicates (default: {DEFAULT_THRESHOLD}).")
+    parser.add_argument("--report", default=None,
+                        help=f"Path of the JSON report (default: {REPORT_NAME} in the directory).")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes (default: 1).")
+    args = parser.parse_args()
+
+    if not 0 < args.threshold <= 1:
+        print(f"Error: --threshold must be between 0 and 1, got {args.threshold}", file=sys.stderr)
+        sys.exit(1)
+    if args.jobs < 1:
+        print(f"Error: --jobs must be at least 1, got {args.jobs}", file=sys.stderr)
+        sys.exit(1)
+    input_path = os.path.abspath(args.directory_path)
+    if not os.path.isdir(input_path):
+        print(f"Error: Input path is not a valid directory: {input_path}", file=sys.stderr)
+        sys.exit(1)
+
+    duplicate_groups = find_duplicates(find_markdown_files(input_path), args.threshold, args.jobs)
+    write_report(args.report or os.path.join(input_path, REPORT_NAME), duplicate_groups, input_path, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
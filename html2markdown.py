@@ -1,9 +1,27 @@
 import argparse
 import codecs
+import concurrent.futures
 import os
 import re  # Added import
+import signal
 import subprocess  # Added import
 import sys
+import time
+
+from image_preprocess import (
+    DEFAULT_MAX_DIMENSION,
+    DEFAULT_QUALITY,
+    PreprocessSettings,
+    default_cache_dir as default_image_cache_dir,
+    preprocess_images,
+)
+from manifest import hash_file, is_unchanged, load_manifest, record_file, remove_missing_inputs, save_manifest
+from metrics import NO_METRICS, MetricsWriter, NoteMetrics
+from shard import in_shard, parse_shard, shard_file_name
+from text_reader import read_text
+from upload_cache import default_cache_path, lookup_uploads, open_upload_cache, store_upload
+from uploaders import DEFAULT_RETRIES, MultipartPostUploader, S3Uploader
+from watch import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, watch_directory
 
 # This script converts HTML files to Markdown format using the html2text library.
 # It can process both single HTML files and directories containing HTML files,
@@ -11,7 +29,22 @@ import sys
 # The converted Markdown files are saved in a new directory named 'html2markdown'
 # relative to the input path.
 #
-# Usage: python html2markdown.py <path_to_html_file_or_directory>
+# The conversion itself is done by html2text by default, or by the faster lxml
+# tree walker in lxml_converter.py with --converter lxml.
+#
+# Images are uploaded with uPic by default, or directly over HTTP with
+# --uploader s3 (an S3-compatible bucket) or --uploader post (a multipart POST
+# endpoint), see uploaders.py and create_uploader.
+#
+# Usage: python html2markdown.py <path_to_html_file_or_directory> [--jobs N] [--converter html2text|lxml]
+#                                [--uploader upic|s3|post --upload-url URL] [--metrics-file FILE] [--quiet] [--watch]
+#                                [--shard I/N]
+#
+# With --watch the script keeps running after the first pass and converts notes
+# again within seconds whenever the export directory changes, see watch.py.
+#
+# With --shard i/N only the i-th of N deterministic shards of the notes is converted,
+# so a large export can be converted on N machines; see shard.py and merge_shards.py.
 
 # Check for html2text dependency at the beginning
 try:
@@ -22,6 +55,20 @@ except ImportError:
 
 OUTPUT_DIR_NAME = "html2markdown"
 UPIC_EXECUTABLE = "/Applications/uPic.app/Contents/MacOS/uPic"  # Path to uPic executable
+DEFAULT_UPLOAD_WORKERS = 4  # Concurrent uploads in the image upload stage
+MANIFEST_NAME = ".html2markdown_manifest.json"  # Manifest for incremental runs, kept in the output directory
+CONVERTER_BACKENDS = ("html2text", "lxml")  # See create_converter
+UPLOADER_BACKENDS = ("upic", "s3", "post")  # See create_uploader
+DEFAULT_CONVERTER = "html2text"
+
+# Per-file progress messages are printed only when VERBOSE is set (disabled by --quiet).
+# Warnings and errors are always printed.
+VERBOSE = True
+
+def log(message):
+    """Prints a per-file progress message unless running quietly."""
+    if VERBOSE:
+        print(message)
 
 def ensure_dir(directory):
     """Ensures that the specified directory exists, creating it if necessary."""
@@ -39,21 +86,21 @@ def upload_image_with_upic(local_image_path):
     try:
         # Ensure the uPic executable path is correct and uPic is installed.
         command = [UPIC_EXECUTABLE, "-u", local_image_path]
-        print(f"Executing uPic command: {' '.join(command)}")
+        log(f"Executing uPic command: {' '.join(command)}")
         result = subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8')
         
         output_lines = result.stdout.splitlines()
         for line in output_lines:
             # uPic typically outputs the URL directly or after "Output URL:"
             if line.startswith("http://") or line.startswith("https://"):
-                print(f"Successfully uploaded {local_image_path} to {line.strip()}")
+                log(f"Successfully uploaded {local_image_path} to {line.strip()}")
                 return line.strip()
         
         # Fallback for varied uPic outputs: search for URL in the entire output
         url_match = re.search(r'(https?://[^\s]+)', result.stdout)
         if url_match:
             url = url_match.group(0)
-            print(f"Successfully uploaded (found via regex) {local_image_path} to {url}")
+            log(f"Successfully uploaded (found via regex) {local_image_path} to {url}")
             return url
 
         print(f"Warning: Could not find URL in uPic output for {local_image_path}.\nStdout:\n{result.stdout}\nStderr:\n{result.stderr}", file=sys.stderr)
@@ -68,63 +115,217 @@ def upload_image_with_upic(local_image_path):
         print(f"An unexpected error occurred during uPic upload for {local_image_path}: {e}", file=sys.stderr)
         return None
 
-def convert_html_to_markdown(input_file_path, output_file_path, converter):
+def add_uploader_arguments(parser):
+    """Adds the options of create_uploader to an argument parser."""
+    parser.add_argument("--uploader", choices=UPLOADER_BACKENDS, default="upic",
+                        help="How images are uploaded: 'upic' runs uPic for each image (default, macOS only), "
+                             "'s3' PUTs them to an S3-compatible bucket (credentials from AWS_ACCESS_KEY_ID, "
+                             "AWS_SECRET_ACCESS_KEY and AWS_REGION), 'post' sends a multipart POST to --upload-url.")
+    parser.add_argument("--upload-url", default=None,
+                        help="Bucket URL for 's3' (path style, e.g. https://s3.us-east-1.amazonaws.com/my-bucket), "
+                             "or the endpoint for 'post'.")
+    parser.add_argument("--upload-public-url", default=None,
+                        help="Base URL the 's3' objects are served from (default: --upload-url).")
+    parser.add_argument("--upload-key-prefix", default="",
+                        help="Prefix of the 's3' object names, e.g. 'wiz/' (default: none).")
+    parser.add_argument("--upload-field", default="file",
+                        help="Form field of the image for 'post' (default: file).")
+    parser.add_argument("--upload-response-field", default=None,
+                        help="Dotted path of the URL in the JSON response for 'post', e.g. 'data.url' "
+                             "(default: the first URL in the response).")
+    parser.add_argument("--upload-header", action="append", default=[],
+                        help="Extra 'Name: value' header for 'post' requests, e.g. an Authorization header. Repeatable.")
+    parser.add_argument("--upload-rate", type=float, default=None,
+                        help="Maximum uploads per second over all upload threads (default: unlimited).")
+    parser.add_argument("--upload-retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries of a failed HTTP upload, with exponential backoff (default: {DEFAULT_RETRIES}).")
+    parser.add_argument("--upload-cache", default=None,
+                        help="Path to the persistent upload cache (default: next to the output directory).")
+    parser.add_argument("--no-upload-cache", action="store_true",
+                        help="Upload every image, ignoring and not updating the upload cache.")
+
+def create_uploader(args):
     """
-    Reads an HTML file, converts it to Markdown, uploads local images,
-    and saves it to the output path.
+    Returns the uploader selected by the add_uploader_arguments options: a callable taking
+    a local image path and returning its remote URL, or None if the upload failed.
+    Raises ValueError if the options are incomplete.
     """
-    try:
-        # Try reading with UTF-8 first, fallback to default encoding with error handling
-        try:
-            with codecs.open(input_file_path, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-        except UnicodeDecodeError:
-            print(f"Warning: UTF-8 decoding failed for {input_file_path}. Trying default encoding.", file=sys.stderr)
-            # Use system's default encoding, ignore errors if it still fails
-            with open(input_file_path, 'r', encoding=sys.getdefaultencoding(), errors='ignore') as f:
-                html_content = f.read()
-
-        markdown_content = converter.handle(html_content)
-
-        # Process local images in Markdown content
-        html_file_dir = os.path.dirname(input_file_path)
-
-        def replace_image_link(match):
-            alt_text = match.group(1)
-            image_path_in_md = match.group(2)
-
-            # If already a web URL, do nothing
-            if image_path_in_md.startswith("http://") or image_path_in_md.startswith("https://"):
-                return match.group(0)  # Return the original full match
-
-            # Construct absolute path for the local image
-            # Image paths from HTML are relative to the HTML file's directory
-            absolute_image_path = os.path.normpath(os.path.join(html_file_dir, image_path_in_md))
-            
-            if not os.path.exists(absolute_image_path):
-                print(f"Warning: Image file not found at resolved path {absolute_image_path} (original: {image_path_in_md}). Keeping original path.", file=sys.stderr)
-                return match.group(0)
-
-            print(f"Found local image: {image_path_in_md}. Absolute path: {absolute_image_path}. Attempting upload...")
-            remote_url = upload_image_with_upic(absolute_image_path)
+    if args.uploader == "upic":
+        return upload_image_with_upic
+    if not args.upload_url:
+        raise ValueError(f"--uploader {args.uploader} requires --upload-url")
+    if args.upload_rate is not None and args.upload_rate <= 0:
+        raise ValueError(f"--upload-rate must be positive, got {args.upload_rate}")
+    if args.upload_retries < 0:
+        raise ValueError(f"--upload-retries must be at least 0, got {args.upload_retries}")
+    options = {"max_retries": args.upload_retries, "rate": args.upload_rate}
+    if args.uploader == "s3":
+        access_key = os.environ.get("AWS_ACCESS_KEY_ID")
+        secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
+        if not access_key or not secret_key:
+            raise ValueError("--uploader s3 requires the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables")
+        region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+        return S3Uploader(args.upload_url, access_key, secret_key, region=region,
+                          session_token=os.environ.get("AWS_SESSION_TOKEN"), key_prefix=args.upload_key_prefix,
+                          public_url_base=args.upload_public_url, **options)
+    headers = {}
+    for header in args.upload_header:
+        name, separator, value = header.partition(":")
+        if not separator:
+            raise ValueError(f"--upload-header must look like 'Name: value', got {header!r}")
+        headers[name.strip()] = value.strip()
+    return MultipartPostUploader(args.upload_url, field_name=args.upload_field, url_field=args.upload_response_field,
+                                 headers=headers, **options)
+
+# Regex to find Markdown image links: ![alt text](path)
+# It captures alt text in group 1 and path in group 2.
+# It excludes paths that already start with http:// or https://.
+IMAGE_LINK_PATTERN = re.compile(r"!\[(.*?)\]\((?!https?://)(.*?)\)")
+
+def resolve_image_path(html_file_dir, image_path_in_md):
+    """
+    Returns the absolute path of a local image referenced from Markdown.
+    Image paths from HTML are relative to the HTML file's directory.
+    """
+    return os.path.normpath(os.path.join(html_file_dir, image_path_in_md))
 
+def find_local_images(markdown_content, html_file_dir):
+    """
+    Returns the absolute paths of all existing local images referenced by the Markdown content,
+    in order of appearance. Missing images are reported and skipped.
+    """
+    image_paths = []
+    for match in IMAGE_LINK_PATTERN.finditer(markdown_content):
+        image_path_in_md = match.group(2)
+        absolute_image_path = resolve_image_path(html_file_dir, image_path_in_md)
+        if not os.path.exists(absolute_image_path):
+            print(f"Warning: Image file not found at resolved path {absolute_image_path} (original: {image_path_in_md}). Keeping original path.", file=sys.stderr)
+            continue
+        image_paths.append(absolute_image_path)
+    return image_paths
+
+def rewrite_image_links(markdown_content, html_file_dir, remote_urls):
+    """
+    Replaces local image links with the remote URLs from remote_urls (absolute path -> URL).
+    Images without a remote URL keep their local path.
+    """
+    def replace_image_link(match):
+        alt_text = match.group(1)
+        image_path_in_md = match.group(2)
+        absolute_image_path = resolve_image_path(html_file_dir, image_path_in_md)
+
+        remote_url = remote_urls.get(absolute_image_path)
+        if remote_url:
+            log(f"Replacing '{image_path_in_md}' with '{remote_url}'")
+            return f"![{alt_text}]({remote_url})"
+        if os.path.exists(absolute_image_path):
+            print(f"Warning: Failed to upload {absolute_image_path}. Keeping local path '{image_path_in_md}'.", file=sys.stderr)
+        return match.group(0)  # Fallback to original full match if upload fails
+
+    return IMAGE_LINK_PATTERN.sub(replace_image_link, markdown_content)
+
+def upload_images(image_paths, max_workers=DEFAULT_UPLOAD_WORKERS, uploader=upload_image_with_upic, cache=None, uploaded=None,
+                  durations=None):
+    """
+    Uploads the unique set of images and returns a dict of absolute path -> remote URL.
+    Images are deduplicated by content hash, so a file referenced many times (or copied
+    under several names) is uploaded only once. Uploads run on a bounded thread pool.
+    If an upload cache connection is given, images uploaded in earlier runs are reused
+    and new uploads are recorded in it. The optional uploaded dict (content hash -> URL)
+    does the same in memory across several calls within one run.
+    If a durations dict is given, the time spent uploading each image is stored in it,
+    keyed by the path that was actually uploaded.
+    Images that failed to upload are missing from the result.
+    """
+    unique_paths = list(dict.fromkeys(image_paths))
+    if not unique_paths:
+        return {}
+
+    remote_urls = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Group paths by content hash; hashlib releases the GIL, so hashing runs in parallel too
+        paths_by_hash = {}
+        for image_path, digest in zip(unique_paths, executor.map(_hash_image, unique_paths)):
+            if digest is not None:
+                paths_by_hash.setdefault(digest, []).append(image_path)
+
+        cached_urls = {}
+        if uploaded is not None:
+            cached_urls.update((digest, uploaded[digest]) for digest in paths_by_hash if digest in uploaded)
+        if cache is not None:
+            cached_urls.update(lookup_uploads(cache, [digest for digest in paths_by_hash if digest not in cached_urls]))
+        for digest, remote_url in cached_urls.items():
+            for image_path in paths_by_hash[digest]:
+                remote_urls[image_path] = remote_url
+        pending = {digest: paths for digest, paths in paths_by_hash.items() if digest not in cached_urls}
+
+        print(f"Uploading {len(pending)} unique images ({len(image_paths)} references, {len(cached_urls)} already uploaded) with {max_workers} threads.")
+        future_to_hash = {executor.submit(_timed_upload, uploader, paths[0]): digest for digest, paths in pending.items()}
+        for future in concurrent.futures.as_completed(future_to_hash):
+            remote_url, seconds = future.result()
+            digest = future_to_hash[future]
+            if durations is not None:
+                durations[pending[digest][0]] = seconds
             if remote_url:
-                print(f"Replacing '{image_path_in_md}' with '{remote_url}'")
-                return f"![{alt_text}]({remote_url})"
-            else:
-                print(f"Warning: Failed to upload {absolute_image_path}. Keeping local path '{image_path_in_md}'.", file=sys.stderr)
-                return match.group(0)  # Fallback to original full match if upload fails
+                for image_path in pending[digest]:
+                    remote_urls[image_path] = remote_url
+                if cache is not None:
+                    store_upload(cache, digest, remote_url, pending[digest][0])
+                if uploaded is not None:
+                    uploaded[digest] = remote_url
+    return remote_urls
+
+def _timed_upload(uploader, image_path):
+    """Runs the uploader and returns (remote_url, seconds)."""
+    start = time.perf_counter()
+    remote_url = uploader(image_path)
+    return remote_url, time.perf_counter() - start
+
+def _hash_image(image_path):
+    """Hashes an image for deduplication, returning None if it cannot be read."""
+    try:
+        return hash_file(image_path)
+    except OSError as e:
+        print(f"Warning: Could not read image {image_path}: {e}", file=sys.stderr)
+        return None
+
+def html_file_to_markdown(input_file_path, converter, metrics=None):
+    """
+    Reads an HTML file and returns its Markdown conversion, with local image links unchanged.
+    The file is read once and its encoding detected (BOM, UTF-8, <meta charset>, GB18030).
+    Read and conversion errors are raised to the caller.
+    Stage timings are added to metrics (a NoteMetrics) if given.
+    """
+    metrics = metrics or NO_METRICS
+    html_content = read_text(input_file_path, metrics, html=True)
+
+    with metrics.stage("html2text"):
+        return converter.handle(html_content)
 
-        # Regex to find Markdown image links: ![alt text](path)
-        # It captures alt text in group 1 and path in group 2.
-        # It excludes paths that already start with http:// or https://.
-        markdown_content = re.sub(r"!\[(.*?)\]\((?!https?://)(.*?)\)", replace_image_link, markdown_content)
+def convert_html_to_markdown(input_file_path, output_file_path, converter, metrics=None):
+    """
+    Reads an HTML file, converts it to Markdown and saves it to the output path.
+    Local image links are kept as-is; they are uploaded and rewritten later by
+    upload_and_rewrite_images. Returns the absolute paths of the local images
+    referenced by the note, or None if the conversion failed.
+    Stage timings and byte counts are added to metrics (a NoteMetrics) if given.
+    """
+    metrics = metrics or NO_METRICS
+    try:
+        markdown_content = html_file_to_markdown(input_file_path, converter, metrics)
 
-        # Ensure the output directory exists before writing
-        ensure_dir(os.path.dirname(output_file_path))
+        # Collect local images in Markdown content for the upload stage
+        with metrics.stage("image_rewrite"):
+            image_paths = find_local_images(markdown_content, os.path.dirname(input_file_path))
 
-        with codecs.open(output_file_path, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
+        with metrics.stage("write"):
+            # Ensure the output directory exists before writing
+            ensure_dir(os.path.dirname(output_file_path))
+            encoded_content = markdown_content.encode('utf-8')
+            with open(output_file_path, 'wb') as f:
+                f.write(encoded_content)
+        metrics.add_bytes("output", len(encoded_content))
+        return image_paths
 
     except FileNotFoundError:
         print(f"Error: Input file not found during conversion: {input_file_path}", file=sys.stderr)
@@ -133,16 +334,128 @@ def convert_html_to_markdown(input_file_path, output_file_path, converter):
     except Exception as e:
         # Catch potential errors during html2text processing
         print(f"Error converting file {input_file_path}: {e}", file=sys.stderr)
+    return None
+
+def upload_and_rewrite_images(converted_notes, upload_workers=DEFAULT_UPLOAD_WORKERS, uploader=upload_image_with_upic, cache_path=None,
+                              note_metrics=None, preprocess=None):
+    """
+    Upload stage of a conversion run.
+    converted_notes is a list of (input_file_path, output_file_path, image_paths) tuples.
+    Uploads all referenced images once, then rewrites the links in the affected Markdown files.
+    If cache_path is given, the persistent upload cache at that path is used.
+    If preprocess (an image_preprocess.PreprocessSettings) is given, the images are
+    downscaled and recompressed first and the smaller copies are uploaded.
+    If note_metrics (output path -> NoteMetrics) is given, the upload time of each image is
+    added to the first note referencing it, and the link rewrite time to every note.
+    Returns the set of output paths that still reference local images because an upload failed.
+    """
+    incomplete_outputs = set()
+    notes_with_images = [note for note in converted_notes if note[2]]
+    if not notes_with_images:
+        return incomplete_outputs
+
+    all_image_paths = [image_path for _, _, image_paths in notes_with_images for image_path in image_paths]
+    cache = open_upload_cache(cache_path) if cache_path else None
+    durations = {} if note_metrics is not None else None
+    # Source image -> file actually uploaded
+    upload_paths = preprocess_images(all_image_paths, preprocess) if preprocess is not None else {}
+    try:
+        uploaded_urls = upload_images([upload_paths.get(image_path, image_path) for image_path in all_image_paths],
+                                      max_workers=upload_workers, uploader=uploader, cache=cache, durations=durations)
+    finally:
+        if cache is not None:
+            cache.close()
+    remote_urls = {image_path: uploaded_urls[upload_paths.get(image_path, image_path)] for image_path in all_image_paths
+                   if upload_paths.get(image_path, image_path) in uploaded_urls}
+
+    for input_file_path, output_file_path, image_paths in notes_with_images:
+        metrics = note_metrics.get(output_file_path, NO_METRICS) if note_metrics is not None else NO_METRICS
+        if durations:
+            for image_path in image_paths:
+                # pop, so an image shared by several notes is only counted once
+                seconds = durations.pop(upload_paths.get(image_path, image_path), None)
+                if seconds is not None:
+                    metrics.add_time("upload", seconds)
+        if any(image_path not in remote_urls for image_path in image_paths):
+            incomplete_outputs.add(output_file_path)
+        try:
+            with metrics.stage("image_rewrite"):
+                markdown_content = read_text(output_file_path)
+                rewritten_content = rewrite_image_links(markdown_content, os.path.dirname(input_file_path), remote_urls)
+                if rewritten_content != markdown_content:
+                    with codecs.open(output_file_path, 'w', encoding='utf-8') as f:
+                        f.write(rewritten_content)
+        except IOError as e:
+            print(f"Error rewriting image links in {output_file_path}: {e}", file=sys.stderr)
+            incomplete_outputs.add(output_file_path)
+    return incomplete_outputs
+
+
+def create_converter(backend=DEFAULT_CONVERTER):
+    """
+    Creates an HTML to Markdown converter configured for Wiz notes.
+    Every backend has the html2text interface: converter.handle(html) returns the Markdown.
+    """
+    if backend == "lxml":
+        from lxml_converter import LxmlConverter
+        return LxmlConverter()
+    if backend != "html2text":
+        raise ValueError(f"Unknown converter backend: {backend}")
+    h = html2text.HTML2Text()
+    # Set options for the converter if needed
+    h.body_width = 0  # Disable automatic line wrapping for cleaner Markdown
+    return h
 
 
-def process_directory_recursive(input_root_dir, output_root_dir, converter):
+# Converter owned by the current worker process when running with --jobs.
+_worker_converter = None
+_worker_collect_metrics = False
+
+
+def _init_worker(verbose=True, collect_metrics=False, converter_backend=DEFAULT_CONVERTER, ignore_interrupt=False):
+    """Gives each worker process its own converter instance and the parent's output settings."""
+    global _worker_converter, _worker_collect_metrics, VERBOSE
+    if ignore_interrupt:
+        # Ctrl+C is handled by the parent, which shuts the pool down
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_converter = create_converter(converter_backend)
+    _worker_collect_metrics = collect_metrics
+    VERBOSE = verbose
+
+
+def create_worker_pool(jobs, collect_metrics=False, converter_backend=DEFAULT_CONVERTER, ignore_interrupt=False):
     """
-    Recursively processes a directory, converting all .html and .htm files
-    to Markdown and replicating the directory structure.
+    Returns a process pool of jobs workers, each with its own converter of the converter_backend kind.
+    With ignore_interrupt the workers ignore Ctrl+C, for a pool kept open while the parent waits.
     """
-    print(f"Starting recursive processing of directory: {input_root_dir}")
-    file_count = 0
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                  initargs=(VERBOSE, collect_metrics, converter_backend, ignore_interrupt))
+
+
+def _convert_worker(task):
+    """
+    Converts a single (input, output) pair inside a worker process.
+    Returns (input_file_path, output_file_path, image_paths, metrics_record), the record being None
+    unless metrics are collected.
+    """
+    input_file_path, output_file_path = task
+    log(f"Converting: {input_file_path} -> {output_file_path}")
+    metrics = NoteMetrics("html2markdown", input_file_path) if _worker_collect_metrics else None
+    image_paths = convert_html_to_markdown(input_file_path, output_file_path, _worker_converter, metrics)
+    return input_file_path, output_file_path, image_paths, metrics.record if metrics else None
+
+
+def find_html_files(input_root_dir, output_root_dir, shard=None):
+    """
+    Walks the input directory and returns a list of (input_file_path, output_file_path)
+    pairs for every .html and .htm file, mirroring the directory structure.
+    If shard (an (index, count) tuple) is given, only the files of that shard are returned.
+    Directories and files are visited in sorted order, like merge_markdown.find_markdown_files,
+    so wiz2dayone.py merges the notes in the same order as merge_markdown.py.
+    """
+    tasks = []
     for root, dirs, files in os.walk(input_root_dir, topdown=True):
+        dirs.sort()
         # Calculate the relative path from the input root
         # This determines the structure within the output directory
         relative_path = os.path.relpath(root, input_root_dir)
@@ -151,23 +464,125 @@ def process_directory_recursive(input_root_dir, output_root_dir, converter):
         # If relative_path is '.', it means we are at the root, output path is output_root_dir
         current_output_dir = os.path.join(output_root_dir, relative_path) if relative_path != '.' else output_root_dir
 
-        # Removed directory creation from here.
-        # ensure_dir will be called by convert_html_to_markdown only if a file needs saving.
-
-        has_html_in_dir = False  # Flag to check if any HTML file exists in the current directory
-        for file in files:
+        for file in sorted(files):
             if file.lower().endswith(('.html', '.htm')):
-                has_html_in_dir = True  # Mark that an HTML file was found
                 input_file_path = os.path.join(root, file)
+                if not in_shard(os.path.relpath(input_file_path, input_root_dir), shard):
+                    continue
                 base, ext = os.path.splitext(file)
                 output_filename = base + ".md"
                 output_file_path = os.path.join(current_output_dir, output_filename)
+                tasks.append((input_file_path, output_file_path))
+    return tasks
 
-                print(f"Converting: {input_file_path} -> {output_file_path}")
-                convert_html_to_markdown(input_file_path, output_file_path, converter)
-                file_count += 1
 
-    print(f"Finished processing directory. Converted {file_count} files.")
+def process_directory_recursive(input_root_dir, output_root_dir, converter, jobs=1, upload_workers=DEFAULT_UPLOAD_WORKERS, upload_cache_path=None, incremental=True,
+                                metrics_writer=None, converter_backend=DEFAULT_CONVERTER, preprocess=None, uploader=upload_image_with_upic,
+                                shard=None, executor=None):
+    """
+    Recursively processes a directory, converting all .html and .htm files
+    to Markdown and replicating the directory structure.
+    With jobs > 1 the files are spread over a process pool, each worker using its own converter
+    of the converter_backend kind. An executor from create_worker_pool is used instead of a new
+    pool if given, so the workers and their converters can be reused over several passes.
+    Local images of all notes are uploaded afterwards in a single deduplicated upload stage,
+    preprocessed first if preprocess settings are given, with the given uploader.
+    With incremental=True, notes unchanged since the last run (according to the manifest in
+    the output directory) are skipped, and outputs of deleted notes are removed.
+    If a MetricsWriter is given, one metrics record is written per converted note.
+    If shard (an (index, count) tuple) is given, only that shard of the notes is converted,
+    with a manifest of its own.
+    """
+    print(f"Starting recursive processing of directory: {input_root_dir}")
+    all_tasks = find_html_files(input_root_dir, output_root_dir, shard)
+    if shard is not None:
+        print(f"Shard {shard[0]}/{shard[1]}: {len(all_tasks)} files.")
+    # Directories are not created here.
+    # ensure_dir will be called by convert_html_to_markdown only if a file needs saving.
+
+    manifest_path = os.path.join(output_root_dir, shard_file_name(MANIFEST_NAME, shard))
+    manifest = load_manifest(manifest_path)
+    relative_inputs = {task[0]: os.path.relpath(task[0], input_root_dir) for task in all_tasks}
+    remove_missing_inputs(manifest, relative_inputs.values(), output_root_dir)
+    tasks = all_tasks
+    if incremental:
+        tasks = [task for task in all_tasks if not is_unchanged(manifest, input_root_dir, relative_inputs[task[0]], output_root_dir)]
+    if len(tasks) < len(all_tasks):
+        print(f"Skipping {len(all_tasks) - len(tasks)} unchanged files.")
+
+    note_metrics = {} if metrics_writer is not None else None
+    converted_notes = []
+    if jobs > 1 and len(tasks) > 1:
+        print(f"Converting {len(tasks)} files with {jobs} worker processes.")
+        # Larger chunks keep inter-process overhead low on exports with many small notes
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        pool = executor or create_worker_pool(jobs, metrics_writer is not None, converter_backend)
+        try:
+            for input_file_path, output_file_path, image_paths, record in pool.map(_convert_worker, tasks, chunksize=chunksize):
+                converted_notes.append((input_file_path, output_file_path, image_paths))
+                if note_metrics is not None:
+                    note_metrics[output_file_path] = NoteMetrics.from_record(record)
+        finally:
+            if executor is None:
+                pool.shutdown()
+    else:
+        for input_file_path, output_file_path in tasks:
+            log(f"Converting: {input_file_path} -> {output_file_path}")
+            metrics = None
+            if note_metrics is not None:
+                metrics = note_metrics[output_file_path] = NoteMetrics("html2markdown", input_file_path)
+            image_paths = convert_html_to_markdown(input_file_path, output_file_path, converter, metrics)
+            converted_notes.append((input_file_path, output_file_path, image_paths))
+
+    incomplete_outputs = upload_and_rewrite_images(converted_notes, upload_workers=upload_workers, cache_path=upload_cache_path,
+                                                   note_metrics=note_metrics, preprocess=preprocess, uploader=uploader)
+    if metrics_writer is not None:
+        for metrics in note_metrics.values():
+            metrics_writer.write(metrics)
+
+    # Notes that failed to convert, or still have images waiting for upload, are retried next run
+    for input_file_path, output_file_path, image_paths in converted_notes:
+        relative_input = relative_inputs[input_file_path]
+        if image_paths is None or output_file_path in incomplete_outputs:
+            manifest["files"].pop(relative_input, None)
+            continue
+        try:
+            record_file(manifest, input_root_dir, relative_input, [os.path.relpath(output_file_path, output_root_dir)])
+        except OSError as e:
+            print(f"Warning: Could not record {input_file_path} in manifest: {e}", file=sys.stderr)
+    try:
+        save_manifest(manifest_path, manifest)
+    except IOError as e:
+        print(f"Warning: Could not write manifest {manifest_path}: {e}", file=sys.stderr)
+
+    print(f"Finished processing directory. Converted {len(tasks)} files.")
+
+
+def add_preprocess_arguments(parser):
+    """Adds the options of preprocess_settings to an argument parser."""
+    parser.add_argument("--preprocess-images", action="store_true",
+                        help="Downscale and recompress images before uploading or embedding them (requires Pillow). "
+                             "Results are cached, so reruns only process new images.")
+    parser.add_argument("--image-max-dimension", type=int, default=DEFAULT_MAX_DIMENSION,
+                        help=f"Maximum width/height of preprocessed images (default: {DEFAULT_MAX_DIMENSION}).")
+    parser.add_argument("--image-quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"JPEG/WebP quality of preprocessed images, 1-95 (default: {DEFAULT_QUALITY}).")
+    parser.add_argument("--image-cache", default=None,
+                        help="Directory of the preprocessed image cache (default: inside the output directory).")
+
+def check_preprocess_arguments(args):
+    """Raises ValueError if the add_preprocess_arguments options are out of range."""
+    if args.image_max_dimension < 1:
+        raise ValueError(f"--image-max-dimension must be at least 1, got {args.image_max_dimension}")
+    if not 1 <= args.image_quality <= 95:
+        raise ValueError(f"--image-quality must be between 1 and 95, got {args.image_quality}")
+
+def preprocess_settings(args, output_dir):
+    """Returns the PreprocessSettings requested on the command line, or None without --preprocess-images."""
+    if not args.preprocess_images:
+        return None
+    return PreprocessSettings(args.image_max_dimension, args.image_quality,
+                              args.image_cache or default_image_cache_dir(output_dir))
 
 
 def main():
@@ -176,8 +591,51 @@ def main():
         description="Convert HTML file(s) to Markdown. Creates an '{}' directory relative to the input path.".format(OUTPUT_DIR_NAME)
     )
     parser.add_argument("input_path", help="Path to the input HTML file or directory.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to convert a directory (default: 1).")
+    parser.add_argument("--converter", choices=CONVERTER_BACKENDS, default=DEFAULT_CONVERTER,
+                        help=f"HTML to Markdown backend (default: {DEFAULT_CONVERTER}). 'lxml' is faster on large notes "
+                             "and needs the lxml library. Use --full to reconvert notes converted with another backend.")
+    parser.add_argument("--upload-workers", type=int, default=DEFAULT_UPLOAD_WORKERS,
+                        help=f"Number of concurrent image uploads (default: {DEFAULT_UPLOAD_WORKERS}).")
+    add_uploader_arguments(parser)
+    add_preprocess_arguments(parser)
+    parser.add_argument("--full", action="store_true",
+                        help="Convert every file, ignoring the manifest of the previous run.")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write per-note stage timings and byte counts as JSON lines to this file, followed by a summary.")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Do not print per-file progress messages (warnings and errors are still printed).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and convert created or modified notes as the directory changes (Ctrl+C to stop).")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"Seconds between two scans of the directory with --watch (default: {DEFAULT_POLL_INTERVAL:g}).")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help=f"Seconds without further changes before converting with --watch (default: {DEFAULT_DEBOUNCE:g}).")
+    parser.add_argument("--shard", default=None, metavar="I/N",
+                        help="Convert only the I-th of N deterministic shards of the notes (e.g. 1/4), "
+                             "to split a large export over several machines. Combine the results with merge_shards.py.")
     args = parser.parse_args()
 
+    global VERBOSE
+    VERBOSE = not args.quiet
+
+    if args.jobs < 1:
+        print(f"Error: --jobs must be at least 1, got {args.jobs}", file=sys.stderr)
+        sys.exit(1)
+    if args.upload_workers < 1:
+        print(f"Error: --upload-workers must be at least 1, got {args.upload_workers}", file=sys.stderr)
+        sys.exit(1)
+    if args.poll_interval <= 0 or args.debounce < 0:
+        print("Error: --poll-interval must be positive and --debounce not negative", file=sys.stderr)
+        sys.exit(1)
+    try:
+        check_preprocess_arguments(args)
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
     # Use absolute path for robustness
     input_path = os.path.abspath(args.input_path)
     # Output directory base path will be determined based on input type
@@ -188,9 +646,17 @@ def main():
         sys.exit(1)
 
     # Initialize the HTML to Markdown converter
-    h = html2text.HTML2Text()
-    # Set options for the converter if needed
-    h.body_width = 0  # Disable automatic line wrapping for cleaner Markdown
+    try:
+        h = create_converter(args.converter)
+        uploader = create_uploader(args)
+    except (ImportError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    metrics_writer = MetricsWriter(args.metrics_file) if args.metrics_file else None
+
+    if os.path.isfile(input_path) and (args.watch or shard is not None):
+        print("Error: --watch and --shard require a directory", file=sys.stderr)
+        sys.exit(1)
 
     if os.path.isfile(input_path):
         if input_path.lower().endswith(('.html', '.htm')):
@@ -200,6 +666,8 @@ def main():
             output_dir_base = os.path.join(input_dir, OUTPUT_DIR_NAME)
             ensure_dir(output_dir_base)  # Create output dir
             print(f"Output will be saved in: {output_dir_base}")
+            upload_cache_path = None if args.no_upload_cache else (args.upload_cache or default_cache_path(output_dir_base))
+            preprocess = preprocess_settings(args, output_dir_base)
 
             base_name = os.path.basename(input_path)
             name, ext = os.path.splitext(base_name)
@@ -208,7 +676,14 @@ def main():
             output_file_path = os.path.join(output_dir_base, output_filename)
 
             print(f"Converting single file: {input_path} -> {output_file_path}")
-            convert_html_to_markdown(input_path, output_file_path, h)
+            metrics = NoteMetrics("html2markdown", input_path) if metrics_writer is not None else None
+            image_paths = convert_html_to_markdown(input_path, output_file_path, h, metrics)
+            upload_and_rewrite_images([(input_path, output_file_path, image_paths)], upload_workers=args.upload_workers, cache_path=upload_cache_path,
+                                      note_metrics={output_file_path: metrics} if metrics is not None else None, preprocess=preprocess,
+                                      uploader=uploader)
+            if metrics_writer is not None:
+                metrics_writer.write(metrics)
+                metrics_writer.close()
             print("Conversion complete.")
         else:
             print(f"Error: Input file is not an HTML file (.html or .htm): {input_path}", file=sys.stderr)
@@ -220,8 +695,31 @@ def main():
         output_dir_base = os.path.join(input_path, OUTPUT_DIR_NAME)
         ensure_dir(output_dir_base)  # Create output dir
         print(f"Output will be saved in: {output_dir_base}")
+        upload_cache_path = None if args.no_upload_cache else (args.upload_cache or default_cache_path(output_dir_base, shard))
+
+        # With --watch the worker processes, like the converter, stay loaded between batches
+        executor = None
+        if args.watch and args.jobs > 1:
+            executor = create_worker_pool(args.jobs, metrics_writer is not None, args.converter, ignore_interrupt=True)
 
-        process_directory_recursive(input_path, output_dir_base, h)
+        def convert_directory(incremental):
+            process_directory_recursive(input_path, output_dir_base, h, jobs=args.jobs,
+                                        upload_workers=args.upload_workers, upload_cache_path=upload_cache_path,
+                                        incremental=incremental, metrics_writer=metrics_writer, converter_backend=args.converter,
+                                        preprocess=preprocess_settings(args, output_dir_base), uploader=uploader, shard=shard,
+                                        executor=executor)
+
+        try:
+            convert_directory(not args.full)
+            if args.watch:
+                # Each batch of changes is an incremental pass
+                watch_directory(input_path, ('.html', '.htm'), lambda changed_paths: convert_directory(True),
+                                poll_interval=args.poll_interval, debounce=args.debounce, exclude_dirs=[output_dir_base])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if metrics_writer is not None:
+            metrics_writer.close()
         # Completion message is printed inside process_directory_recursive
 
     else:
@@ -0,0 +1,164 @@
+import collections
+import concurrent.futures
+import hashlib
+import os
+import sys
+
+from manifest import hash_file
+
+# This module is the optional image preprocessing stage that runs before the upload
+# (--preprocess-images). Wiz notes often embed full resolution camera photos; each
+# image is downscaled to a maximum width/height and recompressed (JPEG and WebP with
+# the given quality, PNG losslessly optimized) by Pillow in a pool of worker processes.
+# The smaller copy is what gets uploaded or embedded; if it is not actually smaller,
+# the original is used.
+#
+# Results are cached in a directory, keyed by the SHA-256 of the source image and
+# the settings, so later runs only process new images:
+#
+#   <cache_dir>/<key>.<ext>   the processed image
+#   <cache_dir>/<key>.keep    marker: the original is already as small as it gets
+#
+# Pillow is optional; without it the stage is skipped with a warning.
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_CACHE_DIR_NAME = ".image_cache"  # Default cache directory, inside the output directory
+DEFAULT_MAX_DIMENSION = 2048
+DEFAULT_QUALITY = 85
+DEFAULT_PREPROCESS_WORKERS = os.cpu_count() or 1
+SETTINGS_VERSION = 1  # Bump when the processing changes, so cached results are redone
+
+# Pillow format name -> file extension of the processed image
+PROCESSED_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+KEEP_MARKER = ".keep"
+
+PreprocessSettings = collections.namedtuple("PreprocessSettings", ["max_dimension", "quality", "cache_dir"])
+
+
+def default_cache_dir(output_dir):
+    """Returns the default image cache directory for an output directory."""
+    return os.path.join(output_dir, IMAGE_CACHE_DIR_NAME)
+
+
+def _cache_key(source_hash, settings):
+    settings_hash = hashlib.sha256(f"{SETTINGS_VERSION}:{settings.max_dimension}:{settings.quality}".encode()).hexdigest()
+    return f"{source_hash}-{settings_hash[:12]}"
+
+
+def _cached_result(cache_dir, key):
+    """Returns the cached processed path, '' if the original is to be kept, or None on a cache miss."""
+    if os.path.exists(os.path.join(cache_dir, key + KEEP_MARKER)):
+        return ""
+    for extension in PROCESSED_FORMATS.values():
+        cached_path = os.path.join(cache_dir, key + extension)
+        if os.path.exists(cached_path):
+            return cached_path
+    return None
+
+
+def preprocess_image(source_path, key, max_dimension, quality, cache_dir):
+    """
+    Resizes and recompresses one image into the cache (runs in a worker process).
+    Returns the processed path, or '' if the original should be used as-is.
+    """
+    with Image.open(source_path) as image:
+        image_format = image.format
+        if image_format not in PROCESSED_FORMATS or getattr(image, "is_animated", False):
+            processed = None
+        else:
+            # Camera photos are often stored sideways with an EXIF orientation tag
+            processed = ImageOps.exif_transpose(image)
+            if max(processed.size) > max_dimension:
+                processed.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            if image_format == "JPEG" and processed.mode not in ("RGB", "L"):
+                processed = processed.convert("RGB")
+
+        if processed is not None:
+            processed_path = os.path.join(cache_dir, key + PROCESSED_FORMATS[image_format])
+            temp_path = processed_path + ".tmp"
+            if image_format == "PNG":
+                processed.save(temp_path, "PNG", optimize=True)
+            else:
+                processed.save(temp_path, image_format, quality=quality, optimize=True)
+            if os.path.getsize(temp_path) < os.path.getsize(source_path):
+                os.replace(temp_path, processed_path)
+                return processed_path
+            os.remove(temp_path)
+
+    with open(os.path.join(cache_dir, key + KEEP_MARKER), 'w'):
+        pass
+    return ""
+
+
+def _preprocess_task(task):
+    source_path, key, max_dimension, quality, cache_dir = task
+    try:
+        return preprocess_image(source_path, key, max_dimension, quality, cache_dir)
+    except Exception as e:
+        # Unreadable or unsupported images are uploaded unchanged
+        print(f"Warning: Could not preprocess image {source_path}: {e}", file=sys.stderr)
+        return ""
+
+
+def _file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+def preprocess_images(image_paths, settings, max_workers=DEFAULT_PREPROCESS_WORKERS):
+    """
+    Preprocesses the unique images in image_paths and returns a dict of
+    source path -> path of the file to upload (the processed copy, or the source itself).
+    Prints the number of bytes saved.
+    """
+    unique_paths = list(dict.fromkeys(image_paths))
+    upload_paths = {image_path: image_path for image_path in unique_paths}
+    if Image is None:
+        print("Warning: Image preprocessing requires the 'Pillow' library ('pip install Pillow'). "
+              "Uploading the original images.", file=sys.stderr)
+        return upload_paths
+    if not unique_paths:
+        return upload_paths
+    os.makedirs(settings.cache_dir, exist_ok=True)
+
+    pending = {}  # key -> source paths with that content
+    cached = 0
+    for image_path in unique_paths:
+        try:
+            key = _cache_key(hash_file(image_path), settings)
+        except OSError as e:
+            print(f"Warning: Could not read image {image_path}: {e}", file=sys.stderr)
+            continue
+        result = _cached_result(settings.cache_dir, key)
+        if result is None:
+            pending.setdefault(key, []).append(image_path)
+        else:
+            cached += 1
+            upload_paths[image_path] = result or image_path
+
+    if pending:
+        print(f"Preprocessing {len(pending)} images ({cached} cached) with {max_workers} worker processes.")
+        tasks = [(paths[0], key, settings.max_dimension, settings.quality, settings.cache_dir) for key, paths in pending.items()]
+        if max_workers > 1 and len(tasks) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_preprocess_task, tasks))
+        else:
+            results = [_preprocess_task(task) for task in tasks]
+        for paths, result in zip(pending.values(), results):
+            for image_path in paths:
+                upload_paths[image_path] = result or image_path
+
+    original_bytes = sum(_file_size(image_path) for image_path in upload_paths)
+    processed_bytes = sum(_file_size(upload_path) for upload_path in upload_paths.values())
+    saved = original_bytes - processed_bytes
+    print(f"Image preprocessing: {original_bytes / (1024 * 1024):.1f} MiB -> {processed_bytes / (1024 * 1024):.1f} MiB, "
+          f"saved {saved / (1024 * 1024):.1f} MiB ({saved / original_bytes * 100 if original_bytes else 0:.0f}%) "
+          f"on {len(upload_paths)} images ({cached} from cache).")
+    return upload_paths
+
@@ -0,0 +1,339 @@
+import re
+import string
+
+# This module is the optional lxml backend of html2markdown.create_converter
+# (--converter lxml). The HTML is parsed by libxml2 and the resulting tree is walked
+# once, which is several times faster than html2text's pure Python parser on large
+# notes (big pasted tables, web clips).
+#
+# The output follows html2text with body_width=0 for the elements Wiz notes use
+# (paragraphs, headings, emphasis, links, images, lists, tables, quotes, code), so
+# the optimize_markdown rules, e.g. the diary date header, work on either backend.
+# Run "python benchmark.py --compare-converters" to check both backends agree on a corpus.
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+SKIPPED_TAGS = {"head", "script", "style", "title", "meta", "link", "noscript", "template"}
+BLOCK_TAGS = {"p", "div", "section", "article", "header", "footer", "nav", "aside", "center", "form",
+              "figure", "figcaption", "main", "dl", "address", "body"}
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+EMPHASIS_MARKERS = {"b": "**", "strong": "**", "i": "_", "em": "_", "u": "_", "del": "~~", "s": "~~", "strike": "~~"}
+# Tags after which html2text does not separate text from a preceding emphasis
+UNSEPARATED_TAGS = {"a", "code", "pre"} | set(HEADING_LEVELS)
+STRESS_SEPARATED_PATTERN = re.compile(r"[^][(){}\s.!?]")
+
+WHITESPACE_PATTERN = re.compile(r"[ \t\n\r\f\v]+")
+# libxml2 drops content after </html>, which html2text keeps; the end tags are implied anyway
+DOCUMENT_END_TAG_PATTERN = re.compile(r"</(?:body|html)\s*>", re.IGNORECASE)
+# Text at the start of a line that Markdown would take for a list item
+LINE_START_ESCAPES = (
+    (re.compile(r"^(\d+)\.(?=\s)"), r"\1\\."),
+    (re.compile(r"^([-+])(?=\s)"), r"\\\1"),
+)
+
+
+class _MarkdownWriter:
+    """Accumulates Markdown, collapsing whitespace and merging requested line breaks."""
+
+    def __init__(self):
+        self.chunks = []
+        self.pending_newlines = 0
+        self.at_line_start = True
+        self.quote_depth = 0  # Number of enclosing blockquotes
+        # Set after a list bullet or the start of a quote: like html2text, block breaks
+        # before the first text that follows are dropped
+        self.block_start = False
+        # html2text's spacing around emphasis depends on the previous text and tag
+        self.preceding_text = ""
+        self.stressed = False
+        self.preceding_stressed = False
+        self.current_tag = None
+        self.after_table = False
+
+    def newlines(self, count):
+        """Requests at least count newlines before the next output (none at the very start)."""
+        if self.chunks and not self.block_start:
+            self.pending_newlines = max(self.pending_newlines, count)
+
+    def start_blockquote(self):
+        """Enters a blockquote; the blank lines before it get the prefix of the enclosing quote, as in html2text."""
+        self.newlines(2)
+        self._flush_blank_lines()
+        self.quote_depth += 1
+        self.block_start = True
+
+    def end_blockquote(self):
+        self.quote_depth -= 1
+        self.block_start = False
+        self.newlines(2)
+
+    def hard_break(self):
+        self.write_raw("  ")
+        self.newlines(1)
+
+    def start_emphasis(self, marker):
+        """Opens an emphasis, separated by a space where html2text would add one."""
+        last = self.preceding_text[-1:]
+        if marker == "_":
+            separate = last and last not in string.whitespace and last not in string.punctuation
+        else:
+            separate = last == marker[0]
+        if separate:
+            self.preceding_text += " "
+        self.write_raw(" " + marker if separate else marker)
+        self.stressed = True
+
+    def _flush_blank_lines(self):
+        if self.pending_newlines:
+            # Blank lines inside a quote keep its ">" marks
+            self.chunks.append("\n" + (">" * self.quote_depth + "\n") * (self.pending_newlines - 1))
+            self.pending_newlines = 0
+            self.at_line_start = True
+
+    def _flush_newlines(self):
+        self._flush_blank_lines()
+        if self.at_line_start and self.quote_depth:
+            self.chunks.append(">" * self.quote_depth + " ")
+
+    def write_raw(self, markup):
+        """Writes Markdown markup as-is."""
+        self._flush_newlines()
+        self.chunks.append(markup)
+        self.at_line_start = False
+        self.after_table = False
+        self.block_start = False
+
+    def write_text(self, text):
+        """Writes document text, collapsing whitespace like a browser does."""
+        if self.stressed:
+            text = text.strip()
+            self.stressed = False
+            self.preceding_stressed = True
+        elif self.preceding_stressed:
+            if STRESS_SEPARATED_PATTERN.match(text) and self.current_tag not in UNSEPARATED_TAGS:
+                text = " " + text
+            self.preceding_stressed = False
+        self.preceding_text = text
+        text = WHITESPACE_PATTERN.sub(" ", text)
+        if self.at_line_start or self.pending_newlines or (self.chunks and self.chunks[-1].endswith((" ", "\n"))):
+            text = text.lstrip(" ")
+        if not text:
+            return
+        starts_line = self.at_line_start or self.pending_newlines
+        self._flush_newlines()
+        if starts_line:
+            for pattern, replacement in LINE_START_ESCAPES:
+                text = pattern.sub(replacement, text)
+        self.chunks.append(text.replace("\xa0", " "))
+        self.at_line_start = False
+        self.after_table = False
+        self.block_start = False
+
+    def getvalue(self):
+        return "".join(self.chunks).rstrip(" \n") + "\n" if self.chunks else ""
+
+    def take_value(self):
+        """Returns the Markdown written so far and starts over with an empty output."""
+        value = self.getvalue()
+        self.chunks = []
+        self.pending_newlines = 0
+        self.at_line_start = True
+        return value
+
+
+class _TableState:
+    """html2text's table state, which nested tables share with the table around them."""
+
+    def __init__(self):
+        self.lines = []
+        self.line = []
+        self.split_next_td = False
+        self.td_count = 0
+        self.table_start = False
+
+    def end_line(self):
+        self.lines.append("".join(self.line))
+        self.line = []
+
+
+class LxmlConverter:
+    """HTML to Markdown converter with the same handle(html) interface as html2text.HTML2Text."""
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("The lxml converter requires the 'lxml' library. Please install it using 'pip install lxml'")
+        self.list_depth = 0
+        self.table = None  # _TableState of the table being written
+
+    def handle(self, html):
+        """Converts an HTML document or fragment to Markdown."""
+        if not html.strip():
+            return ""
+        html = DOCUMENT_END_TAG_PATTERN.sub("", html)
+        try:
+            root = lxml.html.document_fromstring(html)
+        except (lxml.etree.ParserError, ValueError):
+            # ValueError: a str with an XML encoding declaration
+            try:
+                root = lxml.html.document_fromstring(html.encode('utf-8'))
+            except lxml.etree.ParserError:
+                # No elements at all, e.g. only a comment
+                return ""
+        writer = _MarkdownWriter()
+        self.list_depth = 0
+        self.table = None
+        body = root.find("body")
+        self._walk(body if body is not None else root, writer)
+        return writer.getvalue()
+
+    def _walk_children(self, element, writer):
+        if element.text:
+            writer.write_text(element.text)
+        for child in element:
+            if isinstance(child.tag, str):
+                self._walk(child, writer)
+            if child.tail:
+                writer.write_text(child.tail)
+
+    def _walk(self, element, writer):
+        tag = element.tag.lower()
+        if tag in SKIPPED_TAGS:
+            return
+        writer.current_tag = tag
+        if tag in HEADING_LEVELS:
+            writer.newlines(2)
+            writer.write_raw("#" * HEADING_LEVELS[tag] + " ")
+            self._walk_children(element, writer)
+            writer.newlines(2)
+        elif tag in BLOCK_TAGS:
+            writer.newlines(2)
+            self._walk_children(element, writer)
+            writer.newlines(2)
+        elif tag in EMPHASIS_MARKERS:
+            marker = EMPHASIS_MARKERS[tag]
+            writer.start_emphasis(marker)
+            self._walk_children(element, writer)
+            writer.write_raw(marker)
+        elif tag == "br":
+            writer.hard_break()
+        elif tag == "a":
+            href = element.get("href")
+            if not href:
+                self._walk_children(element, writer)
+                return
+            writer.write_raw("[")
+            self._walk_children(element, writer)
+            writer.write_raw(f"]({href})")
+        elif tag == "img":
+            src = element.get("src")
+            if src:
+                writer.write_raw(f"![{element.get('alt', '')}]({src})")
+        elif tag in ("ul", "ol"):
+            self._write_list(element, writer, ordered=tag == "ol")
+        elif tag == "blockquote":
+            writer.start_blockquote()
+            self._walk_children(element, writer)
+            writer.end_blockquote()
+        elif tag in ("dt", "dd"):
+            # html2text indents definitions by four spaces and ends both with a single line break
+            if tag == "dd":
+                writer.write_raw("    ")
+            self._walk_children(element, writer)
+            writer.newlines(1)
+        elif tag == "pre":
+            writer.newlines(2)
+            for line in element.text_content().strip("\n").split("\n"):
+                writer.write_raw("    " + line)
+                writer.newlines(1)
+            writer.newlines(2)
+        elif tag in ("code", "kbd", "tt"):
+            writer.write_raw("`")
+            writer.write_raw(element.text_content())
+            writer.write_raw("`")
+        elif tag == "hr":
+            writer.newlines(2)
+            writer.write_raw("* * *")
+            writer.newlines(2)
+        elif tag == "table":
+            self._write_table(element, writer)
+        else:
+            # span, font, u, li outside a list, unknown tags...: inline content only
+            self._walk_children(element, writer)
+
+    def _write_list(self, element, writer, ordered):
+        writer.newlines(1 if self.list_depth else 2)
+        self.list_depth += 1
+        number = 0
+        if ordered:
+            try:
+                number = int(element.get("start", "1")) - 1
+            except ValueError:
+                pass
+        for item in element:
+            if not isinstance(item.tag, str) or item.tag.lower() != "li":
+                continue
+            number += 1
+            writer.newlines(1)
+            writer.write_raw("  " * self.list_depth + (f"{number}. " if ordered else "* "))
+            # Item content wrapped in <div> or <p> stays on the bullet line
+            writer.block_start = True
+            self._walk_children(item, writer)
+            writer.block_start = False
+        self.list_depth -= 1
+        # html2text leaves two blank lines after a top-level list
+        writer.newlines(1 if self.list_depth else 3)
+
+    def _write_table(self, element, writer):
+        if self.table is not None:
+            # A table inside a cell continues the rows of the table around it, as in html2text
+            self._end_cell_text(writer)
+            self._write_rows(element)
+            return
+        self.table = _TableState()
+        try:
+            self._write_rows(element)
+        finally:
+            table, self.table = self.table, None
+        lines = [line for line in table.lines if line]
+        if not lines:
+            return
+        if writer.after_table:
+            # html2text runs consecutive tables together
+            writer.pending_newlines = 1
+        else:
+            writer.newlines(2)
+        writer.write_raw("  \n".join(lines))
+        writer.newlines(2)
+        writer.after_table = True
+
+    def _write_rows(self, element):
+        """Writes the rows of a table (not those of tables nested in its cells) into self.table."""
+        table = self.table
+        table.table_start = True
+        for row in element.xpath("./tr | ./thead/tr | ./tbody/tr | ./tfoot/tr"):
+            table.td_count = 0
+            for cell in row:
+                if not isinstance(cell.tag, str) or cell.tag.lower() not in ("td", "th"):
+                    continue
+                if table.split_next_td:
+                    table.line.append("| ")
+                table.split_next_td = True
+                table.td_count += 1
+                cell_writer = _MarkdownWriter()
+                self._walk_children(cell, cell_writer)
+                self._end_cell_text(cell_writer)
+            table.split_next_td = False
+            table.end_line()
+            if table.table_start:
+                # Underline of the first row, with that row's number of cells
+                table.line.append("|".join("---" for _ in range(table.td_count)))
+                table.end_line()
+                table.table_start = False
+
+    def _end_cell_text(self, cell_writer):
+        """Adds the cell text written so far to the current table line."""
+        self.table.line.append(WHITESPACE_PATTERN.sub(" ", cell_writer.take_value()).strip())
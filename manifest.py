@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import sys
+
+# This module implements the manifest used for incremental runs of
+# html2markdown.py and optimize_markdown.py.
+# The manifest is a JSON file recording, for every processed input file
+# (keyed by its path relative to the input root), its size, mtime, content
+# hash and the output files produced from it. On the next run only inputs
+# whose size/mtime or content changed are processed again, and outputs of
+# inputs that no longer exist are removed.
+
+MANIFEST_VERSION = 1
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    """Loads a manifest, returning an empty one if it is missing or unreadable."""
+    empty = {"version": MANIFEST_VERSION, "files": {}}
+    if not os.path.exists(manifest_path):
+        return empty
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as e:
+        print(f"Warning: Could not read manifest {manifest_path}: {e}. Processing all files.", file=sys.stderr)
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION or not isinstance(manifest.get("files"), dict):
+        print(f"Warning: Unsupported manifest format in {manifest_path}. Processing all files.", file=sys.stderr)
+        return empty
+    return manifest
+
+def save_manifest(manifest_path, manifest):
+    """Writes the manifest atomically, so an interrupted run never leaves a truncated file."""
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def is_unchanged(manifest, input_root, relative_path, output_root=None):
+    """
+    Returns True if the input file matches its manifest entry and all its outputs still exist.
+    Size and mtime are checked first; the content hash is only computed when they differ,
+    so a touched but identical file is not processed again.
+    """
+    entry = manifest["files"].get(relative_path)
+    if entry is None:
+        return False
+    if output_root is not None:
+        for output in entry.get("outputs", []):
+            if not os.path.exists(os.path.join(output_root, output)):
+                return False
+
+    input_path = os.path.join(input_root, relative_path)
+    try:
+        stat = os.stat(input_path)
+    except OSError:
+        return False
+    if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+        return True
+    if stat.st_size != entry["size"]:
+        return False
+    try:
+        if hash_file(input_path) != entry["sha256"]:
+            return False
+    except OSError:
+        return False
+    # Same content with a new mtime: refresh the entry so the next run takes the fast path
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+def record_file(manifest, input_root, relative_path, outputs=()):
+    """Records the current state of an input file and the outputs (relative to the output root) produced from it."""
+    input_path = os.path.join(input_root, relative_path)
+    stat = os.stat(input_path)
+    manifest["files"][relative_path] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": hash_file(input_path),
+        "outputs": list(outputs),
+    }
+
+def remove_missing_inputs(manifest, current_relative_paths, output_root=None):
+    """
+    Drops manifest entries whose input no longer exists and, if output_root is given,
+    deletes the outputs produced from them. Returns the list of removed input paths.
+    """
+    current = set(current_relative_paths)
+    removed = [relative_path for relative_path in manifest["files"] if relative_path not in current]
+    for relative_path in removed:
+        entry = manifest["files"].pop(relative_path)
+        if output_root is None:
+            continue
+        for output in entry.get("outputs", []):
+            output_path = os.path.join(output_root, output)
+            if os.path.exists(output_path):
+                print(f"Removing output of deleted note: {output_path}")
+                try:
+                    os.remove(output_path)
+                except OSError as e:
+                    print(f"Warning: Could not remove {output_path}: {e}", file=sys.stderr)
+    return removed
@@ -1,46 +1,223 @@
+import argparse
+import datetime
+import glob
 import os
+import re
+import sqlite3
 import sys
+import time
+
+from dedupe import DEFAULT_THRESHOLD, REPORT_NAME, duplicate_map, find_duplicates, write_report
+from metrics import NO_METRICS, MetricsWriter, NoteMetrics
+from text_reader import read_text
+from wiz_index import date_from_diary_header, load_note_dates, lookup_note_date, read_note_header
 
 # Day one docs: https://dayoneapp.com/blog/help_guides/importing-data-from-plain-text/
 # This script merges the content of markdown files into a single text file.
 # It prepends a specific date string to the content of each markdown file.
 # The merged content is saved in a text file named 'merged_result.txt' 
 # under the same directory as the input markdown files.
+# Notes are streamed to the output one at a time, so memory use does not grow
+# with the size of the archive. With --max-bytes or --max-entries the output is
+# split into merged_result_001.txt, merged_result_002.txt, ... instead.
+#
+# By default every entry gets the same fixed date (DATE_PREFIX). With --index-db the
+# real created (or modified) date of each note is taken from the Wiz index.db; notes
+# not found there, or all notes with --sort-by-date alone, use the date of their
+# "My Diary" DD/MM header when they have one. --sort-by-date writes the entries in date order.
 #
-# Usage: python merge_markdown_to_txt.py <path_to_markdown_files_directory>
+# With --dedupe drop, exact and near duplicate notes (conflict copies, clipped twice, ...)
+# are left out of the merge, only the longest note of each group is kept; with
+# --dedupe flag they are kept and marked. A report of the duplicates is written, see dedupe.py.
+#
+# Usage: python merge_markdown.py <path_to_markdown_files_directory> [--max-bytes N] [--max-entries N] [--metrics-file FILE]
+#                                 [--index-db PATH [--date-field created|modified]] [--sort-by-date]
+#                                 [--dedupe drop|flag [--dedupe-threshold 0.8]]
 
 # Define the date string to prepend
 DATE_PREFIX = "\n\nDate: 2020年9月22日 GMT+8 00:00:00\n\n"
+DEFAULT_DATE = datetime.datetime(2020, 9, 22)  # The date of DATE_PREFIX, used to sort notes without a date
+TIMEZONE_LABEL = "GMT+8"
+
+OUTPUT_BASENAME = "merged_result"
+
+def format_date_prefix(note_date):
+    """Returns the Day One 'Date:' line for a datetime, in the same format as DATE_PREFIX."""
+    return (f"\n\nDate: {note_date.year}年{note_date.month}月{note_date.day}日 {TIMEZONE_LABEL} "
+            f"{note_date:%H:%M:%S}\n\n")
+
+def format_entry(content, note_date=None):
+    """Formats the content of one note as a Day One plain text entry, dated note_date or DATE_PREFIX."""
+    # Prepend the date prefix to the content
+    return (format_date_prefix(note_date) if note_date else DATE_PREFIX) + content
+
+def format_duplicate_flag(kept_path, similarity, exact, root_dir):
+    """Returns the line that marks a duplicate note with --dedupe flag."""
+    kind = "exact duplicate" if exact else f"{similarity:.0%} similar"
+    return f"Duplicate of: {os.path.relpath(kept_path, root_dir)} ({kind})\n\n"
 
-def process_markdown_file(filepath):
-    """Reads a markdown file, prepends the date string, and returns the content."""
+def process_markdown_file(filepath, metrics=None, note_date=None, flag=None):
+    """
+    Reads a markdown file, prepends the date string, and returns the content.
+    flag, if given, is put before the content (see format_duplicate_flag).
+    Stage timings are added to metrics (a NoteMetrics) if given.
+    """
+    metrics = metrics or NO_METRICS
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        # Prepend the date prefix to the content
-        return DATE_PREFIX + content
+        content = read_text(filepath, metrics)
+        # Normalize line endings the way text mode reading does
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return format_entry(flag + content if flag else content, note_date)
     except Exception as e:
         print(f"Error processing file {filepath}: {e}", file=sys.stderr)
         return ""
 
 def find_markdown_files(directory):
-    """Recursively finds all markdown files (.md) in a directory."""
+    """
+    Recursively finds all markdown files (.md) in a directory.
+    Directories and files are visited in sorted order, so the merged output is the same
+    on every file system, including a tree combined from shards by merge_shards.py.
+    """
     markdown_files = []
-    for root, _, files in os.walk(directory):
-        for file in files:
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
             # Check for .md extension (case-insensitive)
             if file.lower().endswith('.md'):
                 markdown_files.append(os.path.join(root, file))
     return markdown_files
 
+def resolve_note_dates(markdown_files, root_dir, note_dates=None):
+    """
+    Returns a dict of markdown file -> datetime (or None) for every file.
+    Dates come from the Wiz index (note_dates, see wiz_index.load_note_dates) when the note
+    is found there, otherwise from the diary header at the start of the note.
+    """
+    resolved = {}
+    from_index = from_header = 0
+    for md_file in markdown_files:
+        relative_path = os.path.relpath(md_file, root_dir)
+        note_date = lookup_note_date(note_dates, relative_path) if note_dates else None
+        if note_date is not None:
+            from_index += 1
+        else:
+            note_date = date_from_diary_header(read_note_header(md_file), relative_path)
+            if note_date is not None:
+                from_header += 1
+        resolved[md_file] = note_date
+    missing = len(markdown_files) - from_index - from_header
+    print(f"Dates: {from_index} from index.db, {from_header} from diary headers, {missing} using the default date.")
+    return resolved
+
+def output_file_path(output_dir, part_number=None):
+    """Returns merged_result.txt, or merged_result_NNN.txt for a numbered part of a split output."""
+    if part_number is None:
+        return os.path.join(output_dir, OUTPUT_BASENAME + ".txt")
+    return os.path.join(output_dir, f"{OUTPUT_BASENAME}_{part_number:03d}.txt")
+
+def write_merged_entries(entries, output_dir, max_bytes=None, max_entries=None, entry_written=None):
+    """
+    Streams entries (strings) to the merged output file(s) and returns the list of written paths.
+    Without limits everything goes to merged_result.txt. With max_bytes and/or max_entries,
+    a new numbered part is started before an entry that would exceed a limit
+    (a single entry larger than max_bytes still gets a part of its own).
+    If given, entry_written(seconds, byte_count) is called after each entry is written.
+    """
+    split = max_bytes is not None or max_entries is not None
+    output_paths = []
+    outfile = None
+    part_bytes = 0
+    part_entries = 0
+
+    def start_part():
+        nonlocal outfile, part_bytes, part_entries
+        if outfile is not None:
+            outfile.close()
+        path = output_file_path(output_dir, len(output_paths) + 1 if split else None)
+        # Binary mode so the byte limit is measured on the exact encoded output
+        outfile = open(path, 'wb')
+        output_paths.append(path)
+        part_bytes = 0
+        part_entries = 0
+
+    try:
+        for entry in entries:
+            if not entry:
+                continue
+            start = time.perf_counter()
+            data = entry.encode('utf-8')
+            if outfile is None:
+                start_part()
+            elif split and part_entries > 0 and (
+                (max_entries is not None and part_entries >= max_entries)
+                or (max_bytes is not None and part_bytes + len(data) > max_bytes)
+            ):
+                start_part()
+            outfile.write(data)
+            part_bytes += len(data)
+            part_entries += 1
+            if entry_written is not None:
+                entry_written(time.perf_counter() - start, len(data))
+        if outfile is None:
+            # Still create an (empty) output file if there was nothing to merge
+            start_part()
+    finally:
+        if outfile is not None:
+            outfile.close()
+
+    # Outputs of an earlier run would otherwise be imported along with this one
+    remove_stale_parts(output_dir, len(output_paths) if split else 0)
+    unsplit_path = output_file_path(output_dir)
+    if split and os.path.exists(unsplit_path):
+        print(f"Removing stale output: {unsplit_path}")
+        os.remove(unsplit_path)
+    return output_paths
+
+def remove_stale_parts(output_dir, part_count):
+    """Removes numbered parts left over from an earlier run that produced more parts (or was split when this one is not)."""
+    part_pattern = re.compile(re.escape(OUTPUT_BASENAME) + r"_(\d{3,})\.txt$")
+    for path in glob.glob(os.path.join(glob.escape(output_dir), OUTPUT_BASENAME + "_*.txt")):
+        match = part_pattern.search(os.path.basename(path))
+        if match and int(match.group(1)) > part_count:
+            print(f"Removing stale output part: {path}")
+            os.remove(path)
+
 def main():
-    # Check if the correct number of arguments is provided
-    if len(sys.argv) != 2:
-        print("Usage: python merge_markdown_to_txt.py <path_to_markdown_file_or_directory>", file=sys.stderr)
+    parser = argparse.ArgumentParser(
+        description="Merge markdown files into a Day One plain text import file ({}.txt).".format(OUTPUT_BASENAME)
+    )
+    parser.add_argument("input_path", help="Path to a markdown file or a directory containing markdown files.")
+    parser.add_argument("--max-bytes", type=int, default=None,
+                        help="Split the output into numbered parts of at most this many bytes.")
+    parser.add_argument("--max-entries", type=int, default=None,
+                        help="Split the output into numbered parts of at most this many entries.")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write per-note stage timings and byte counts as JSON lines to this file, followed by a summary.")
+    parser.add_argument("--index-db", default=None,
+                        help="Wiz index.db (~/.wiznote/<user>/data/index.db) to take each note's real date from.")
+    parser.add_argument("--date-field", choices=("created", "modified"), default="created",
+                        help="Which index.db date to use (default: created).")
+    parser.add_argument("--sort-by-date", action="store_true", help="Write the entries in date order.")
+    parser.add_argument("--dedupe", choices=("drop", "flag"), default=None,
+                        help="Find exact and near duplicate notes and leave them out of the merge (drop) "
+                             "or mark them (flag). The longest note of each group is kept unchanged.")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Minimum similarity (0-1) of near duplicates (default: {DEFAULT_THRESHOLD}).")
+    parser.add_argument("--dedupe-report", default=None,
+                        help=f"Path of the duplicate report (default: {REPORT_NAME} next to the output).")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to fingerprint the notes for --dedupe (default: 1).")
+    args = parser.parse_args()
+
+    for name, value in (("--max-bytes", args.max_bytes), ("--max-entries", args.max_entries), ("--jobs", args.jobs)):
+        if value is not None and value < 1:
+            print(f"Error: {name} must be at least 1, got {value}", file=sys.stderr)
+            sys.exit(1)
+    if not 0 < args.dedupe_threshold <= 1:
+        print(f"Error: --dedupe-threshold must be between 0 and 1, got {args.dedupe_threshold}", file=sys.stderr)
         sys.exit(1)
 
-    input_path = sys.argv[1]
-    all_content = ""
+    input_path = args.input_path
     markdown_files_to_process = []
     output_dir = "" # Define output directory variable
 
@@ -69,28 +246,70 @@ def main():
          print(f"Error: Input path is not a valid file or directory: {input_path}", file=sys.stderr)
          sys.exit(1)
 
-    # Process each found markdown file
-    for md_file in markdown_files_to_process:
-        processed_content = process_markdown_file(md_file)
-        all_content += processed_content
+    dates = {}
+    if args.index_db or args.sort_by_date:
+        note_dates = None
+        if args.index_db:
+            try:
+                note_dates = load_note_dates(args.index_db, args.date_field)
+            except sqlite3.Error as e:
+                print(f"Error reading Wiz index {args.index_db}: {e}", file=sys.stderr)
+                sys.exit(1)
+        dates = resolve_note_dates(markdown_files_to_process, output_dir, note_dates)
+        if args.sort_by_date:
+            # Stable sort, so notes with the same date keep their directory order
+            markdown_files_to_process.sort(key=lambda md_file: dates[md_file] or DEFAULT_DATE)
+
+    duplicates = {}
+    if args.dedupe:
+        duplicate_groups = find_duplicates(markdown_files_to_process, args.dedupe_threshold, args.jobs)
+        try:
+            write_report(args.dedupe_report or os.path.join(output_dir, REPORT_NAME), duplicate_groups, output_dir,
+                         args.dedupe_threshold)
+        except IOError as e:
+            print(f"Warning: Could not write duplicate report: {e}", file=sys.stderr)
+        duplicates = duplicate_map(duplicate_groups)
+        if args.dedupe == "drop":
+            markdown_files_to_process = [md_file for md_file in markdown_files_to_process if md_file not in duplicates]
+
+    # Each markdown file is read, prefixed and written straight to the output.
+    # Note: The first file's content will start with the DATE_PREFIX,
+    # including the leading newlines.
+    metrics_writer = MetricsWriter(args.metrics_file) if args.metrics_file else None
+    current_metrics = None
+
+    def entries():
+        nonlocal current_metrics
+        for md_file in markdown_files_to_process:
+            if metrics_writer is not None:
+                # The previous note has been written by now
+                if current_metrics is not None:
+                    metrics_writer.write(current_metrics)
+                current_metrics = NoteMetrics("merge_markdown", md_file)
+            flag = format_duplicate_flag(*duplicates[md_file], output_dir) if md_file in duplicates else None
+            yield process_markdown_file(md_file, current_metrics, dates.get(md_file), flag)
+
+    def entry_written(seconds, byte_count):
+        current_metrics.add_time("write", seconds)
+        current_metrics.add_bytes("output", byte_count)
 
-    # Define the output filename and construct the full path
-    output_filename = "merged_result.txt"
-    # Construct the full output path using the determined output directory
-    output_filepath = os.path.join(output_dir, output_filename)
     try:
-        # Write the concatenated content to the output file using the full path
-        with open(output_filepath, 'w', encoding='utf-8') as outfile:
-            # Note: The first file's content will start with the DATE_PREFIX,
-            # including the leading newlines.
-            outfile.write(all_content)
-        # Use the full path in the success message
-        print(f"Successfully merged markdown content into {output_filepath}")
+        output_paths = write_merged_entries(entries(), output_dir, max_bytes=args.max_bytes, max_entries=args.max_entries,
+                                            entry_written=entry_written if metrics_writer is not None else None)
     except Exception as e:
-        # Use the full path in the error message
-        print(f"Error writing to output file {output_filepath}: {e}", file=sys.stderr)
+        print(f"Error writing merged output in {output_dir}: {e}", file=sys.stderr)
         sys.exit(1)
 
+    if metrics_writer is not None:
+        if current_metrics is not None:
+            metrics_writer.write(current_metrics)
+        metrics_writer.close()
+
+    if len(output_paths) == 1:
+        print(f"Successfully merged markdown content into {output_paths[0]}")
+    else:
+        print(f"Successfully merged markdown content into {len(output_paths)} files: {output_paths[0]} ... {output_paths[-1]}")
+
 # Standard Python entry point check
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+import argparse
+import os
+import shutil
+import sys
+
+import html2markdown
+import optimize_markdown
+from manifest import hash_file, load_manifest, save_manifest
+from merge_markdown import OUTPUT_BASENAME, find_markdown_files, process_markdown_file, write_merged_entries
+from shard import parse_shard_file_name
+from upload_cache import UPLOAD_CACHE_NAME, default_cache_path, import_uploads, open_upload_cache
+
+# This script combines the results of a conversion split over several machines with
+# html2markdown.py --shard i/N (and optionally optimize_markdown.py --shard i/N)
+# into one tree, as if the whole export had been converted on a single machine:
+#
+#   1. The html2markdown output directory of every shard is copied into the merged
+#      directory. The shards convert disjoint sets of notes, so files only collide if
+#      the same note was converted by two shards (e.g. with different N); the first
+#      shard given wins and a warning is printed.
+#   2. The per-shard manifests (.html2markdown_manifest.shard-i-of-N.json, ...) are
+#      combined into the normal manifests, so later runs without --shard are incremental.
+#      Missing shards are reported.
+#   3. The per-shard upload caches (html2markdown_upload_cache.shard-i-of-N.sqlite, next
+#      to each shard directory) are imported into the upload cache of the merged directory.
+#   4. merged_result.txt is written from the merged tree, in sorted path order, so the
+#      result does not depend on the number of shards or the order they finished in.
+#
+# The shard directories may also be synced into the merged directory beforehand
+# (e.g. with rsync); then run this script with the merged directory only.
+#
+# Usage: python merge_shards.py <merged_output_directory> [<shard_output_directory> ...]
+
+MERGED_MANIFEST_NAMES = (html2markdown.MANIFEST_NAME, optimize_markdown.MANIFEST_NAME)
+
+
+def same_file_content(path_a, path_b):
+    """Returns True if two files have the same content (sizes first, hashes only if they match)."""
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    return hash_file(path_a) == hash_file(path_b)
+
+
+def is_regenerated(relative_path):
+    """Returns True for the files this script writes again: the unsharded manifests and merged_result*.txt."""
+    name = os.path.basename(relative_path)
+    if relative_path != name:
+        return False
+    return name in MERGED_MANIFEST_NAMES or (name.startswith(OUTPUT_BASENAME) and name.endswith(".txt"))
+
+
+def copy_shard_tree(shard_dir, merged_dir):
+    """
+    Copies the files of a shard output directory into the merged directory.
+    Identical files are skipped; a file that exists with different content is kept and
+    reported. Returns (copied, conflicts).
+    """
+    copied = conflicts = 0
+    for root, dirs, files in os.walk(shard_dir):
+        dirs.sort()
+        for file in sorted(files):
+            source_path = os.path.join(root, file)
+            relative_path = os.path.relpath(source_path, shard_dir)
+            if is_regenerated(relative_path):
+                continue
+            target_path = os.path.join(merged_dir, relative_path)
+            if os.path.exists(target_path):
+                if not same_file_content(source_path, target_path):
+                    print(f"Warning: {relative_path} differs between shards, keeping {target_path}", file=sys.stderr)
+                    conflicts += 1
+                continue
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            shutil.copy2(source_path, target_path)
+            copied += 1
+    return copied, conflicts
+
+
+def find_shard_files(directory, base_name):
+    """Returns {(index, count): path} of the shard versions of base_name in a directory."""
+    shard_files = {}
+    if not os.path.isdir(directory):
+        return shard_files
+    for name in sorted(os.listdir(directory)):
+        parsed = parse_shard_file_name(name)
+        if parsed is not None and parsed[0] == base_name:
+            shard_files[parsed[1]] = os.path.join(directory, name)
+    return shard_files
+
+
+def check_complete(shard_files, description):
+    """Warns if the shards found are not exactly 1..N of a single N."""
+    counts = sorted({count for _, count in shard_files})
+    if len(counts) > 1:
+        print(f"Warning: {description} come from different shard counts ({', '.join(map(str, counts))}); "
+              "notes may be missing or converted twice.", file=sys.stderr)
+        return
+    if counts:
+        missing = [str(index) for index in range(1, counts[0] + 1) if (index, counts[0]) not in shard_files]
+        if missing:
+            print(f"Warning: {description} of shards {', '.join(missing)} of {counts[0]} are missing.", file=sys.stderr)
+
+
+def merge_manifests(merged_dir):
+    """Combines the per-shard manifests in the merged directory into the unsharded manifests."""
+    for manifest_name in MERGED_MANIFEST_NAMES:
+        shard_manifests = find_shard_files(merged_dir, manifest_name)
+        if not shard_manifests:
+            continue
+        check_complete(shard_manifests, f"{manifest_name} manifests")
+        manifest_path = os.path.join(merged_dir, manifest_name)
+        manifest = load_manifest(manifest_path)
+        for shard in sorted(shard_manifests):
+            manifest["files"].update(load_manifest(shard_manifests[shard])["files"])
+        save_manifest(manifest_path, manifest)
+        print(f"Merged {len(shard_manifests)} shard manifests into {manifest_path} ({len(manifest['files'])} files).")
+
+
+def merge_upload_caches(merged_dir, shard_dirs):
+    """Imports the per-shard upload caches found next to the shard and merged directories."""
+    cache_paths = {}
+    for directory in [merged_dir] + shard_dirs:
+        parent_dir = os.path.dirname(os.path.abspath(directory))
+        for shard, cache_path in find_shard_files(parent_dir, UPLOAD_CACHE_NAME).items():
+            cache_paths.setdefault(shard, cache_path)
+    if not cache_paths:
+        return
+    check_complete(cache_paths, "upload caches")
+    merged_cache_path = default_cache_path(merged_dir)
+    conn = open_upload_cache(merged_cache_path)
+    try:
+        imported = sum(import_uploads(conn, cache_paths[shard]) for shard in sorted(cache_paths))
+    finally:
+        conn.close()
+    print(f"Imported {imported} uploads from {len(cache_paths)} shard caches into {merged_cache_path}.")
+
+
+def main():
+    """Main function to parse arguments and merge the shard outputs."""
+    parser = argparse.ArgumentParser(
+        description="Combine html2markdown.py --shard outputs into one tree, manifest, upload cache and {}.txt.".format(OUTPUT_BASENAME)
+    )
+    parser.add_argument("merged_dir", help="Directory to merge into (created if necessary).")
+    parser.add_argument("shard_dirs", nargs="*",
+                        help="html2markdown output directories of the shards, copied into the merged directory.")
+    args = parser.parse_args()
+
+    merged_dir = os.path.abspath(args.merged_dir)
+    shard_dirs = [os.path.abspath(shard_dir) for shard_dir in args.shard_dirs]
+    for shard_dir in shard_dirs:
+        if not os.path.isdir(shard_dir):
+            print(f"Error: Shard directory not found: {shard_dir}", file=sys.stderr)
+            sys.exit(1)
+    os.makedirs(merged_dir, exist_ok=True)
+
+    for shard_dir in shard_dirs:
+        if os.path.samefile(shard_dir, merged_dir):
+            continue
+        copied, conflicts = copy_shard_tree(shard_dir, merged_dir)
+        print(f"Copied {copied} files from {shard_dir}" + (f" ({conflicts} conflicts)." if conflicts else "."))
+
+    merge_manifests(merged_dir)
+    merge_upload_caches(merged_dir, shard_dirs)
+
+    markdown_files = find_markdown_files(merged_dir)
+    try:
+        output_paths = write_merged_entries((process_markdown_file(md_file) for md_file in markdown_files), merged_dir)
+    except Exception as e:
+        print(f"Error writing merged output in {merged_dir}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Successfully merged {len(markdown_files)} markdown files into {output_paths[0]}")
+
+
+if __name__ == "__main__":
+    main()
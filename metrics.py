@@ -0,0 +1,134 @@
+import contextlib
+import json
+import math
+import sys
+import time
+
+# This module writes the per-note metrics requested with --metrics-file.
+# Every processed note becomes one JSON line with the duration of each stage
+# (read, decode, html2text, image_rewrite, upload, write, ...) and byte counts:
+#
+#   {"tool": "html2markdown", "path": "...", "stages": {"read": 0.0004, ...}, "bytes": {"input": 1234, ...}}
+#
+# When the file is closed, a final summary line is appended with the p50/p95/max
+# of every stage and the slowest notes, and the summary is printed as well.
+
+SLOWEST_NOTES = 10  # Number of slowest notes listed in the summary
+
+
+class NoteMetrics:
+    """Stage timings and byte counts of a single note."""
+
+    def __init__(self, tool, path):
+        self.record = {"tool": tool, "path": path, "stages": {}, "bytes": {}}
+
+    @classmethod
+    def from_record(cls, record):
+        """Wraps a record collected elsewhere, e.g. in a worker process."""
+        metrics = cls(record["tool"], record["path"])
+        metrics.record = record
+        return metrics
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the enclosed block and adds it to the named stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        stages = self.record["stages"]
+        stages[name] = stages.get(name, 0.0) + seconds
+
+    def add_bytes(self, name, count):
+        counts = self.record["bytes"]
+        counts[name] = counts.get(name, 0) + count
+
+
+class NullMetrics:
+    """Stand-in for NoteMetrics when metrics are not collected; every call is a no-op."""
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def add_time(self, name, seconds):
+        pass
+
+    def add_bytes(self, name, count):
+        pass
+
+
+NO_METRICS = NullMetrics()
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[max(0, rank - 1)]
+
+
+def summarize(records, slowest=SLOWEST_NOTES):
+    """Returns the summary (per-stage p50/p95/max/total and slowest notes) of a list of note records."""
+    durations = {}
+    totals = []
+    for record in records:
+        for name, seconds in record["stages"].items():
+            durations.setdefault(name, []).append(seconds)
+        totals.append((sum(record["stages"].values()), record["path"]))
+
+    stages = {}
+    for name, values in durations.items():
+        values.sort()
+        stages[name] = {
+            "notes": len(values),
+            "p50": _percentile(values, 0.50),
+            "p95": _percentile(values, 0.95),
+            "max": values[-1],
+            "total": sum(values),
+        }
+    totals.sort(reverse=True)
+    return {
+        "notes": len(records),
+        "stages": stages,
+        "slowest": [{"path": path, "seconds": seconds} for seconds, path in totals[:slowest]],
+    }
+
+
+class MetricsWriter:
+    """Writes note records as JSON lines and a summary line when closed."""
+
+    def __init__(self, metrics_path):
+        self.metrics_path = metrics_path
+        self.file = open(metrics_path, 'w', encoding='utf-8')
+        # Only the fields needed for the summary are kept in memory
+        self.records = []
+
+    def write(self, record):
+        """Writes one note record (a NoteMetrics or its record dict)."""
+        if isinstance(record, NoteMetrics):
+            record = record.record
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.records.append({"path": record["path"], "stages": record["stages"]})
+
+    def close(self):
+        """Appends the summary line, prints the summary and closes the file."""
+        summary = summarize(self.records)
+        self.file.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+        self.file.close()
+        print_summary(summary)
+        print(f"Metrics written to {self.metrics_path}")
+
+
+def print_summary(summary, file=sys.stdout):
+    """Prints a per-stage table and the slowest notes."""
+    print(f"Stage timings over {summary['notes']} notes (milliseconds):", file=file)
+    print(f"  {'stage':<14} {'p50':>9} {'p95':>9} {'max':>9} {'total':>11}", file=file)
+    for name, stats in summary["stages"].items():
+        print(f"  {name:<14} {stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} "
+              f"{stats['max'] * 1000:>9.2f} {stats['total'] * 1000:>11.1f}", file=file)
+    if summary["slowest"]:
+        print("Slowest notes:", file=file)
+        for note in summary["slowest"]:
+            print(f"  {note['seconds'] * 1000:9.1f} ms  {note['path']}", file=file)
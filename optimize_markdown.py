@@ -1,107 +1,197 @@
 import argparse
-import codecs
+import collections
+import concurrent.futures
 import os
 import re
 import sys
+import time
 
+from manifest import is_unchanged, load_manifest, record_file, remove_missing_inputs, save_manifest
+from metrics import NO_METRICS, MetricsWriter, NoteMetrics
+from shard import in_shard, parse_shard, shard_file_name
+from text_reader import read_text
+from watch import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, watch_directory
+
+MANIFEST_NAME = ".optimize_markdown_manifest.json"  # Manifest for incremental runs, kept in the processed directory
+
+# Per-file progress messages are printed only when VERBOSE is set (disabled by --quiet).
+# Warnings and errors are always printed.
+VERBOSE = True
+
+def log(message):
+    """Prints a per-file progress message unless running quietly."""
+    if VERBOSE:
+        print(message)
+
+# Pattern for the Wiz "My Diary" date header:
+# Optional leading whitespace
+# DD
+#
+# MM
+#
+# DAY_OF_WEEK
+#
+#  ____
+#
+#   * __ (four times)
+# (one empty line)
+#   * __ (four times)
+# Replaces with DD/MM/DAY_OF_WEEK
+# The optional leading whitespace is not part of the regex: a leading \s* makes the
+# matcher retry every position of a long whitespace run, which is quadratic.
+# Instead the pattern starts at the day digits ((?<!\d) keeps it from retrying inside
+# a run of digits) and optimize_date strips the whitespace before each match itself.
+DATE_PATTERN = re.compile(
+    r"(?<!\d)(\d+)\n\n(\d+)\n\n([^\n]+)\n\n[ \t]*____[ \t]*\n\n"
+    r"(?:[ \t]*\*[ \t]*__[ \t]*\n){4}\n\n(?:[ \t]*\*[ \t]*__[ \t]*\n){3}[ \t]*\*[ \t]*__[ \t]*"
+)
+DATE_REPLACEMENT = r"\1/\2/\3"
+
+# A rewrite rule applied to every Markdown file.
+# prefilter: a substring that must occur in the content for the rule to possibly match
+#            (None to always run the rule); files without it skip the rule entirely.
+# apply: function (content, file_path) -> (new_content, number_of_changes).
+RewriteRule = collections.namedtuple("RewriteRule", ["name", "prefilter", "apply"])
 
 def optimize_date(markdown_content):
     """
     Optimizes specific Markdown patterns, e.g., a custom date format.
+    Returns (optimized_content, num_replacements).
     """
-    # Pattern for:
-    # Optional leading whitespace
-    # DD
-    #
-    # MM
-    #
-    # DAY_OF_WEEK
-    #
-    #  ____
-    #
-    #   * __ (four times)
-    # (one empty line)
-    #   * __ (four times)
-    # Replaces with DD/MM/DAY_OF_WEEK
-    # Adjusted pattern based on repr output:
-    # - Added \s* at the beginning for leading whitespace (and BOM if not handled by utf-8-sig)
-    # - Changed separator between the two '* __' blocks from \n to \n\n
-    pattern = r"\s*(\d+)\n\n(\d+)\n\n([^\n]+)\n\n[ \t]*____[ \t]*\n\n(?:[ \t]*\*[ \t]*__[ \t]*\n){4}\n\n(?:[ \t]*\*[ \t]*__[ \t]*\n){3}[ \t]*\*[ \t]*__[ \t]*"
-    replacement = r"\1/\2/\3"
-    
-    optimized_content, num_replacements = re.subn(pattern, replacement, markdown_content)
-    
+    if "____" not in markdown_content:
+        return markdown_content, 0
+
+    parts = []
+    last_end = 0
+    num_replacements = 0
+    for match in DATE_PATTERN.finditer(markdown_content):
+        # Drop the leading whitespace, as the original \s* prefix of the pattern did
+        parts.append(markdown_content[last_end:match.start()].rstrip())
+        parts.append(match.expand(DATE_REPLACEMENT))
+        last_end = match.end()
+        num_replacements += 1
     if num_replacements == 0:
-        # Debug print if no replacements were made
-        print(f"DEBUG: Pattern did not match. Content start (repr): {repr(markdown_content[:500])}")
-        # You can also print the full repr(markdown_content) if needed, or write it to a debug file.
-        # print(f"DEBUG: Full pattern used: {pattern}")
+        return markdown_content, 0
+    parts.append(markdown_content[last_end:])
+    return "".join(parts), num_replacements
 
-    # if num_replacements > 0:
-    #     print(f"Optimized date format ({num_replacements} occurrence(s)).")
+def _apply_date_rule(content, file_path):
+    optimized_content, num_replacements = optimize_date(content)
+    if num_replacements > 0:
+        log(f"Optimized date format in: {file_path} ({num_replacements} replacement(s))")
     return optimized_content, num_replacements
 
-def process_markdown_file(file_path):
+def _apply_index_title_rule(content, file_path):
+    # Add title for index.md files
+    filename = os.path.basename(file_path)
+    if filename.lower() != "index.md":
+        return content, 0
+    parent_dir_name = os.path.basename(os.path.dirname(file_path))
+    # Check if title already exists to avoid duplication
+    if content.strip().startswith(f"# {parent_dir_name}"):
+        log(f"Title already exists in: {file_path}")
+        return content, 0
+    log(f"Added title to: {file_path}")
+    return f"# {parent_dir_name}\n\n" + content, 1
+
+# Rules are compiled once at import and applied in order.
+# New cleanups are added here; a cheap prefilter keeps them from costing a full pass on files they cannot match.
+REWRITE_RULES = [
+    RewriteRule("wiz_diary_date", "____", _apply_date_rule),
+    RewriteRule("index_title", None, _apply_index_title_rule),
+]
+
+def _empty_rule_counters():
+    return {"files": 0, "hits": 0, "prefiltered": 0, "seconds": 0.0}
+
+def new_rule_stats(rules=REWRITE_RULES):
+    """Returns empty per-rule statistics: files that matched, total hits, files skipped by the prefilter, time spent."""
+    return {rule.name: _empty_rule_counters() for rule in rules}
+
+def merge_rule_stats(total, stats):
+    """Adds the per-rule statistics in stats into total."""
+    for name, counters in stats.items():
+        target = total.setdefault(name, _empty_rule_counters())
+        for key, value in counters.items():
+            target[key] += value
+
+def print_rule_stats(stats):
+    """Prints a per-rule summary of hits and timing."""
+    for name, counters in stats.items():
+        print(f"Rule {name}: {counters['hits']} hit(s) in {counters['files']} file(s), "
+              f"{counters['prefiltered']} file(s) skipped by prefilter, {counters['seconds'] * 1000:.1f} ms")
+
+def apply_rewrite_rules(content, file_path, rules=REWRITE_RULES, stats=None):
+    """
+    Applies the rewrite rules in order to the content of the Markdown file at file_path.
+    Per-rule hit counts and timing are accumulated into stats if given.
+    Returns (optimized_content, made_changes).
+    """
+    made_changes = False
+    for rule in rules:
+        counters = stats.setdefault(rule.name, _empty_rule_counters()) if stats is not None else None
+        if rule.prefilter is not None and rule.prefilter not in content:
+            if counters is not None:
+                counters["prefiltered"] += 1
+            continue
+        start = time.perf_counter()
+        content, hits = rule.apply(content, file_path)
+        if counters is not None:
+            counters["seconds"] += time.perf_counter() - start
+            if hits:
+                counters["files"] += 1
+                counters["hits"] += hits
+        if hits:
+            made_changes = True
+    return content, made_changes
+
+def optimize_markdown_content(content, file_path, stats=None):
+    """
+    Applies all optimizations to the content of the Markdown file at file_path
+    (the path is used for the index.md title). Returns (optimized_content, made_changes).
+    """
+    return apply_rewrite_rules(content, file_path, stats=stats)
+
+def read_markdown_file(file_path, metrics=NO_METRICS):
+    """
+    Reads a Markdown file once and decodes it, removing a BOM if present.
+    The encoding is detected by text_reader.read_text (UTF-8, otherwise GB18030);
+    the optimized file is always written back as UTF-8.
+    """
+    return read_text(file_path, metrics)
+
+def process_markdown_file(file_path, dry_run=False, stats=None, metrics=None):
     """
     Reads a Markdown file, optimizes its content, adds a title if it's an index.md file, and writes it back.
+    The file is read and decoded once. Returns True if the file was changed
+    (with dry_run=True: would be changed, without writing it), False if not, and None on error.
+    Per-rule statistics are accumulated into stats, and stage timings into metrics
+    (a NoteMetrics), if given.
     """
+    metrics = metrics or NO_METRICS
     try:
-        # Try reading with UTF-8-SIG first to handle BOM, then fallback
-        original_content_for_write_check = "" # Store content before any modification for accurate change detection
-        try:
-            # Use 'utf-8-sig' to automatically remove BOM
-            with codecs.open(file_path, 'r', encoding='utf-8-sig') as f:
-                content = f.read()
-                original_content_for_write_check = content
-        except UnicodeDecodeError:
-            print(f"Warning: UTF-8-SIG decoding failed for {file_path}. Trying utf-8.", file=sys.stderr)
-            try:
-                with codecs.open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    original_content_for_write_check = content
-            except UnicodeDecodeError:
-                print(f"Warning: UTF-8 decoding failed for {file_path}. Trying default encoding.", file=sys.stderr)
-                # Use system's default encoding, ignore errors if it still fails
-                with open(file_path, 'r', encoding=sys.getdefaultencoding(), errors='ignore') as f:
-                    content = f.read()
-                    original_content_for_write_check = content
-        
-        current_content = content
-        made_changes = False
-
-        # Optimize date format
-        optimized_date_content, num_date_replacements = optimize_date(current_content)
-        if num_date_replacements > 0:
-            current_content = optimized_date_content
-            made_changes = True
-            print(f"Optimized date format in: {file_path} ({num_date_replacements} replacement(s))")
-
-        # Add title for index.md files
-        filename = os.path.basename(file_path)
-        if filename.lower() == "index.md":
-            parent_dir_name = os.path.basename(os.path.dirname(file_path))
-            title_to_add = f"# {parent_dir_name}\n\n"
-            # Check if title already exists to avoid duplication
-            if not current_content.strip().startswith(f"# {parent_dir_name}"):
-                current_content = title_to_add + current_content
-                made_changes = True
-                print(f"Added title to: {file_path}")
-            else:
-                print(f"Title already exists in: {file_path}")
-
-
-        if made_changes:
-            # Only write if content has actually changed from the initially read version
-            # This check is more robust than just relying on num_replacements if multiple operations occur
-            if current_content != original_content_for_write_check:
-                 with codecs.open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(current_content)
-            else:
-                # This case might happen if, for example, a title was "added" but it was already there
-                # and no date optimization occurred.
-                print(f"No effective changes to write for: {file_path}")
-        # else:
-            # print(f"No changes needed for: {file_path}")
+        content = read_markdown_file(file_path, metrics)
+        with metrics.stage("rules"):
+            current_content, made_changes = optimize_markdown_content(content, file_path, stats=stats)
+
+        if not made_changes:
+            return False
+        # Only write if content has actually changed from the initially read version
+        # This check is more robust than just relying on num_replacements if multiple operations occur
+        if current_content == content:
+            # This case might happen if, for example, a title was "added" but it was already there
+            # and no date optimization occurred.
+            log(f"No effective changes to write for: {file_path}")
+            return False
+        if dry_run:
+            print(f"Would optimize: {file_path}")
+            return True
+        with metrics.stage("write"):
+            encoded_content = current_content.encode('utf-8')
+            with open(file_path, 'wb') as f:
+                f.write(encoded_content)
+        metrics.add_bytes("output", len(encoded_content))
+        return True
 
     except FileNotFoundError:
         print(f"Error: File not found: {file_path}", file=sys.stderr)
@@ -109,40 +199,108 @@ def process_markdown_file(file_path):
         print(f"Error reading/writing file {file_path}: {e}", file=sys.stderr)
     except Exception as e:
         print(f"Error processing file {file_path}: {e}", file=sys.stderr)
+    return None
+
+def _init_worker(verbose=True):
+    """Passes the parent's output settings to a worker process."""
+    global VERBOSE
+    VERBOSE = verbose
+
+def _optimize_worker(task):
+    """
+    Processes a single (file_path, dry_run, collect_metrics) task inside a worker process,
+    returning (changed, rule_stats, metrics_record); changed is None if the file could not be processed.
+    """
+    file_path, dry_run, collect_metrics = task
+    stats = new_rule_stats()
+    metrics = NoteMetrics("optimize_markdown", file_path) if collect_metrics else None
+    changed = process_markdown_file(file_path, dry_run=dry_run, stats=stats, metrics=metrics)
+    return changed, stats, metrics.record if metrics else None
 
-def process_directory_recursive(directory_path):
+def process_directory_recursive(directory_path, incremental=True, jobs=1, dry_run=False, metrics_writer=None, shard=None):
     """
     Recursively processes all .md files in a directory.
+    With incremental=True, files unchanged since they were last optimized
+    (according to the manifest in the directory) are skipped.
+    With jobs > 1 the files are spread over a process pool.
+    With dry_run=True nothing is written; the files that would change are reported.
+    If a MetricsWriter is given, one metrics record is written per processed file.
+    If shard (an (index, count) tuple) is given, only the files of that shard are processed,
+    with a manifest of their own (see shard.py).
     """
     print(f"Starting recursive processing of directory: {directory_path}")
-    file_count = 0
-    optimized_files_count = 0
+    skipped_count = 0
+
+    manifest_path = os.path.join(directory_path, shard_file_name(MANIFEST_NAME, shard))
+    manifest = load_manifest(manifest_path)
+    relative_paths = []
+    files_to_process = []
+    rule_stats = new_rule_stats()
 
     for root, _, files in os.walk(directory_path):
         for file in files:
             if file.lower().endswith(".md"):
                 file_path = os.path.join(root, file)
-                # Store original content to check if it changed, to count optimized files
-                try:
-                    with codecs.open(file_path, 'r', encoding='utf-8') as f_orig:
-                        original_content = f_orig.read()
-                except Exception: # Broad catch for reading issues, will be handled in process_markdown_file
-                    original_content = "" 
-                
-                process_markdown_file(file_path)
-                file_count += 1
-
-                # Check if content was actually modified to count optimized files
-                if original_content: # Only if we could read original content
-                    try:
-                        with codecs.open(file_path, 'r', encoding='utf-8') as f_new:
-                            new_content = f_new.read()
-                        if new_content != original_content:
-                             optimized_files_count +=1
-                    except Exception:
-                        pass # Error reading new content, skip check
-
-    print(f"Finished processing directory. Processed {file_count} .md files. Optimized {optimized_files_count} files.")
+                relative_path = os.path.relpath(file_path, directory_path)
+                if not in_shard(relative_path, shard):
+                    continue
+                relative_paths.append(relative_path)
+                if incremental and is_unchanged(manifest, directory_path, relative_path):
+                    skipped_count += 1
+                    continue
+                files_to_process.append((file_path, relative_path))
+
+    if jobs > 1 and len(files_to_process) > 1:
+        print(f"Processing {len(files_to_process)} files with {jobs} worker processes.")
+        chunksize = max(1, len(files_to_process) // (jobs * 8))
+        worker_tasks = [(file_path, dry_run, metrics_writer is not None) for file_path, _ in files_to_process]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(VERBOSE,)) as executor:
+            results = []
+            for changed, worker_stats, record in executor.map(_optimize_worker, worker_tasks, chunksize=chunksize):
+                results.append(changed)
+                merge_rule_stats(rule_stats, worker_stats)
+                if metrics_writer is not None:
+                    metrics_writer.write(record)
+    else:
+        results = []
+        for file_path, _ in files_to_process:
+            metrics = NoteMetrics("optimize_markdown", file_path) if metrics_writer is not None else None
+            results.append(process_markdown_file(file_path, dry_run=dry_run, stats=rule_stats, metrics=metrics))
+            if metrics_writer is not None:
+                metrics_writer.write(metrics)
+
+    optimized_files_count = sum(1 for changed in results if changed)
+    failed_count = sum(1 for changed in results if changed is None)
+    print_rule_stats(rule_stats)
+
+    if dry_run:
+        if skipped_count:
+            print(f"Skipped {skipped_count} unchanged files.")
+        print(f"Dry run finished. Checked {len(files_to_process)} .md files. {optimized_files_count} files would be optimized.")
+        return
+
+    # Record the optimized state so the files are skipped until they change again.
+    # Files that failed are left out, so they are retried on the next run.
+    for (file_path, relative_path), changed in zip(files_to_process, results):
+        if changed is None:
+            manifest["files"].pop(relative_path, None)
+            continue
+        try:
+            record_file(manifest, directory_path, relative_path)
+        except OSError as e:
+            print(f"Warning: Could not record {file_path} in manifest: {e}", file=sys.stderr)
+
+    remove_missing_inputs(manifest, relative_paths)
+    try:
+        save_manifest(manifest_path, manifest)
+    except IOError as e:
+        print(f"Warning: Could not write manifest {manifest_path}: {e}", file=sys.stderr)
+
+    if skipped_count:
+        print(f"Skipped {skipped_count} unchanged files.")
+    if failed_count:
+        print(f"{failed_count} files could not be processed and will be retried on the next run.", file=sys.stderr)
+    print(f"Finished processing directory. Processed {len(files_to_process)} .md files. Optimized {optimized_files_count} files.")
 
 def main():
     """Main function to parse arguments and initiate processing."""
@@ -150,16 +308,58 @@ def main():
         description="Recursively find and optimize Markdown files in a directory."
     )
     parser.add_argument("directory_path", help="Path to the directory containing Markdown files. If the path contains spaces or special characters, ensure it is properly quoted (e.g., enclosed in double quotes).")
+    parser.add_argument("--full", action="store_true", help="Process every file, ignoring the manifest of the previous run.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes (default: 1).")
+    parser.add_argument("--dry-run", action="store_true", help="Report which files would be optimized without writing them.")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write per-file stage timings and byte counts as JSON lines to this file, followed by a summary.")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Do not print per-file progress messages (warnings and errors are still printed).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and optimize created or modified files as the directory changes (Ctrl+C to stop).")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"Seconds between two scans of the directory with --watch (default: {DEFAULT_POLL_INTERVAL:g}).")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help=f"Seconds without further changes before optimizing with --watch (default: {DEFAULT_DEBOUNCE:g}).")
+    parser.add_argument("--shard", default=None, metavar="I/N",
+                        help="Process only the I-th of N deterministic shards of the files (e.g. 1/4), "
+                             "the same split as html2markdown.py --shard.")
     args = parser.parse_args()
 
+    global VERBOSE
+    VERBOSE = not args.quiet
+
+    if args.jobs < 1:
+        print(f"Error: --jobs must be at least 1, got {args.jobs}", file=sys.stderr)
+        sys.exit(1)
+    if args.poll_interval <= 0 or args.debounce < 0:
+        print("Error: --poll-interval must be positive and --debounce not negative", file=sys.stderr)
+        sys.exit(1)
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
     input_path = os.path.abspath(args.directory_path)
 
     if not os.path.isdir(input_path):
         print(f"Error: Input path is not a valid directory: {input_path}", file=sys.stderr)
         sys.exit(1)
 
-    process_directory_recursive(input_path)
-    print("Optimization complete.")
+    metrics_writer = MetricsWriter(args.metrics_file) if args.metrics_file else None
+    process_directory_recursive(input_path, incremental=not args.full, jobs=args.jobs, dry_run=args.dry_run,
+                                metrics_writer=metrics_writer, shard=shard)
+    if args.watch:
+        # The rules stay compiled; each batch of changes is an incremental pass
+        watch_directory(input_path, ('.md',),
+                        lambda changed_paths: process_directory_recursive(input_path, jobs=args.jobs, dry_run=args.dry_run,
+                                                                          metrics_writer=metrics_writer, shard=shard),
+                        poll_interval=args.poll_interval, debounce=args.debounce)
+    if metrics_writer is not None:
+        metrics_writer.close()
+    if not args.dry_run:
+        print("Optimization complete.")
 
 if __name__ == "__main__":
     main()
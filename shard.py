@@ -0,0 +1,64 @@
+import hashlib
+import os
+import re
+import unicodedata
+
+# This module splits the notes of an export into N deterministic shards, so
+# html2markdown.py and optimize_markdown.py can each be run on several machines
+# with --shard i/N (i = 1..N) and the results combined with merge_shards.py.
+#
+# A note belongs to shard (hash of its path relative to the input root) % N + 1.
+# The path is taken without its extension, with '/' separators and in Unicode NFC
+# (macOS stores decomposed file names), so a note.html and the note.md converted
+# from it are in the same shard on every platform and every run.
+#
+# Files that every shard writes into a shared location get a shard suffix:
+#
+#   .html2markdown_manifest.json  ->  .html2markdown_manifest.shard-2-of-4.json
+
+SHARD_SPEC_PATTERN = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+SHARD_FILE_PATTERN = re.compile(r"^(?P<base>.*)\.shard-(?P<index>\d+)-of-(?P<count>\d+)(?P<ext>\.[^.]*)?$")
+
+
+def parse_shard(value):
+    """Parses a --shard value 'i/N' into an (index, count) tuple, raising ValueError if it is invalid."""
+    match = SHARD_SPEC_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"--shard must look like i/N (e.g. 1/4), got {value!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise ValueError(f"--shard index must be between 1 and {count}, got {value!r}")
+    return index, count
+
+
+def shard_key(relative_path):
+    """Returns the platform independent name of a note that decides its shard."""
+    key = os.path.splitext(relative_path)[0].replace(os.sep, "/")
+    return unicodedata.normalize("NFC", key)
+
+
+def shard_of(relative_path, count):
+    """Returns the shard (1..count) of the note at relative_path."""
+    digest = hashlib.sha256(shard_key(relative_path).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def in_shard(relative_path, shard):
+    """Returns True if the note belongs to shard (an (index, count) tuple); always True without a shard."""
+    return shard is None or shard_of(relative_path, shard[1]) == shard[0]
+
+
+def shard_file_name(file_name, shard):
+    """Returns the name a shard uses for a file shared by all shards, e.g. a manifest or upload cache."""
+    if shard is None:
+        return file_name
+    base, ext = os.path.splitext(file_name)
+    return f"{base}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def parse_shard_file_name(file_name):
+    """Returns (unsharded file name, (index, count)) for a name made by shard_file_name, or None."""
+    match = SHARD_FILE_PATTERN.match(file_name)
+    if not match:
+        return None
+    return match.group("base") + (match.group("ext") or ""), (int(match.group("index")), int(match.group("count")))
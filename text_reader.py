@@ -0,0 +1,137 @@
+import codecs
+import mmap
+import os
+import re
+import sys
+
+from metrics import NO_METRICS
+
+# This module is the single place where notes are read and decoded.
+# Each file is read once (large files are memory-mapped instead of copied) and
+# decoded once with the first encoding that fits, in this order:
+#
+#   1. a byte order mark (UTF-8, UTF-16, UTF-32)
+#   2. UTF-8
+#   3. for HTML only, the charset declared by a <meta charset=...> or
+#      <meta http-equiv=... content="...charset=..."> (Markdown may quote such a tag as text)
+#   4. GB18030, a superset of GBK/GB2312, which many old Wiz notes use
+#
+# UTF-8 comes before the declared charset: legacy decoders such as GB18030 accept
+# most UTF-8 Chinese text as well, producing mojibake, while text in a legacy charset
+# is almost never valid UTF-8. Web clips often declare a charset they are not in.
+#
+# If none of them decodes the file cleanly, it is decoded as UTF-8 with invalid
+# bytes replaced by U+FFFD and a warning is printed, so no text is silently dropped.
+
+MMAP_THRESHOLD = 8 * 1024 * 1024  # Files at least this large are memory-mapped
+META_SCAN_SIZE = 4096  # The <meta charset> must be within the first bytes of an HTML file
+
+BOMS = (
+    # UTF-32 first, its little-endian BOM starts with the UTF-16 one
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+META_CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+FALLBACK_ENCODINGS = ("utf-8", "gb18030")
+
+# Declared charsets that are decoded with a superset, as browsers do
+ENCODING_ALIASES = {
+    "gbk": "gb18030",
+    "gb2312": "gb18030",
+    "x-gbk": "gb18030",
+    "ascii": "utf-8",
+    "us-ascii": "utf-8",
+}
+
+
+def _normalize_encoding(name):
+    """Returns the Python codec name for a declared charset, or None if it is unknown."""
+    name = name.decode('ascii', errors='ignore').strip().lower()
+    name = ENCODING_ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def _try_decode(data, encoding, final=True):
+    """Decodes data strictly, returning None if it is not valid in that encoding."""
+    try:
+        # An incremental decoder tolerates a character cut off at the end when final is False
+        return codecs.getincrementaldecoder(encoding)().decode(data, final)
+    except UnicodeDecodeError:
+        return None
+
+
+def detect_bom(data):
+    """Returns (encoding, bom_length) if data starts with a byte order mark, otherwise (None, 0)."""
+    for bom, encoding in BOMS:
+        if data[:len(bom)] == bom:
+            return encoding, len(bom)
+    return None, 0
+
+
+def declared_encoding(data):
+    """Returns the encoding declared by an HTML <meta> tag near the start of data, or None."""
+    match = META_CHARSET_PATTERN.search(data[:META_SCAN_SIZE])
+    return _normalize_encoding(match.group(1)) if match else None
+
+
+def decode_bytes(data, file_path="<bytes>", truncated=False, html=False):
+    """
+    Decodes the bytes of a note (bytes or any buffer, e.g. an mmap) and returns (text, encoding).
+    Set truncated when data is only the beginning of a file, so a multi-byte character
+    cut off at the end does not make an encoding fail.
+    Set html for HTML documents, so a charset declared by a <meta> tag is taken into account.
+    """
+    encoding, bom_length = detect_bom(data)
+    if encoding is not None:
+        text = _try_decode(memoryview(data)[bom_length:], encoding, final=not truncated)
+        if text is not None:
+            return text, encoding
+
+    candidates = list(FALLBACK_ENCODINGS)
+    if html:
+        candidates.insert(1, declared_encoding(data))
+    for encoding in dict.fromkeys(candidate for candidate in candidates if candidate):
+        text = _try_decode(data, encoding, final=not truncated)
+        if text is not None:
+            return text, encoding
+
+    print(f"Warning: Could not detect the encoding of {file_path}. Decoding as UTF-8, "
+          "invalid bytes are replaced with U+FFFD.", file=sys.stderr)
+    return str(data, 'utf-8', errors='replace'), "utf-8"
+
+
+def read_text(file_path, metrics=NO_METRICS, html=False):
+    """
+    Reads and decodes a note with a single read, see decode_bytes (html: the file is an HTML document).
+    Read and decode times and the input size are added to metrics (a NoteMetrics) if given.
+    """
+    with metrics.stage("read"):
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_THRESHOLD:
+                data = f.read()
+                mapped = None
+            else:
+                data = mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    metrics.add_bytes("input", size)
+    try:
+        with metrics.stage("decode"):
+            text, _ = decode_bytes(data, file_path, html=html)
+        return text
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def read_text_head(file_path, size):
+    """Reads and decodes only the first size bytes of a note."""
+    with open(file_path, 'rb') as f:
+        data = f.read(size)
+    text, _ = decode_bytes(data, file_path, truncated=len(data) == size)
+    return text
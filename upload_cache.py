@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+from shard import shard_file_name
+
+# This module keeps a persistent cache of uploaded images, mapping the SHA-256
+# hash of an image's content to the remote URL it was uploaded to.
+# html2markdown.py consults it before uploading, so images that were uploaded
+# in an earlier run are never sent again.
+#
+# The cache can also be inspected and maintained from the command line:
+#
+# Usage: python upload_cache.py <cache_file> stats
+#        python upload_cache.py <cache_file> list [--limit N]
+#        python upload_cache.py <cache_file> prune [--older-than DAYS] [--missing-sources]
+#        python upload_cache.py <cache_file> invalidate [--hash H ...] [--url U ...] [--path P ...] [--all]
+
+UPLOAD_CACHE_NAME = "html2markdown_upload_cache.sqlite"
+
+# SQLite limits the number of bound parameters per statement
+_QUERY_BATCH_SIZE = 500
+
+def default_cache_path(output_dir, shard=None):
+    """
+    Returns the default cache location, next to the html2markdown output directory.
+    Each shard of a --shard run gets its own cache file, see merge_shards.py.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(output_dir)), shard_file_name(UPLOAD_CACHE_NAME, shard))
+
+def open_upload_cache(cache_path):
+    """Opens (creating if necessary) the upload cache database and returns the connection."""
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS uploads (
+               content_hash TEXT PRIMARY KEY,
+               remote_url TEXT NOT NULL,
+               source_path TEXT,
+               size INTEGER,
+               uploaded_at REAL NOT NULL,
+               last_used_at REAL NOT NULL
+           )"""
+    )
+    conn.commit()
+    return conn
+
+def lookup_uploads(conn, content_hashes):
+    """
+    Returns a dict of content hash -> remote URL for the hashes already in the cache,
+    and marks them as used.
+    """
+    content_hashes = list(content_hashes)
+    found = {}
+    for i in range(0, len(content_hashes), _QUERY_BATCH_SIZE):
+        batch = content_hashes[i:i + _QUERY_BATCH_SIZE]
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"SELECT content_hash, remote_url FROM uploads WHERE content_hash IN ({placeholders})", batch
+        )
+        found.update(rows)
+    if found:
+        now = time.time()
+        conn.executemany(
+            "UPDATE uploads SET last_used_at = ? WHERE content_hash = ?",
+            [(now, content_hash) for content_hash in found]
+        )
+        conn.commit()
+    return found
+
+def store_upload(conn, content_hash, remote_url, source_path=None):
+    """Records a successful upload. Committed immediately so interrupted runs keep their progress."""
+    size = None
+    if source_path and os.path.exists(source_path):
+        size = os.path.getsize(source_path)
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO uploads (content_hash, remote_url, source_path, size, uploaded_at, last_used_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (content_hash, remote_url, source_path, size, now, now)
+    )
+    conn.commit()
+
+def import_uploads(conn, other_cache_path):
+    """
+    Copies the entries of another upload cache file into conn. Where both have uploaded
+    the same image, the earlier upload is kept. Returns the number of imported entries.
+    """
+    other = sqlite3.connect(other_cache_path)
+    try:
+        rows = other.execute(
+            "SELECT content_hash, remote_url, source_path, size, uploaded_at, last_used_at FROM uploads"
+        ).fetchall()
+    finally:
+        other.close()
+    existing = dict(conn.execute("SELECT content_hash, uploaded_at FROM uploads"))
+    new_rows = [row for row in rows if row[0] not in existing or row[4] < existing[row[0]]]
+    conn.executemany(
+        "INSERT OR REPLACE INTO uploads (content_hash, remote_url, source_path, size, uploaded_at, last_used_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        new_rows
+    )
+    conn.commit()
+    return len(new_rows)
+
+def cache_stats(conn):
+    """Returns (entry count, total bytes of the cached source images)."""
+    count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads").fetchone()
+    return count, total_size
+
+def list_uploads(conn, limit=None):
+    """Returns cache entries as (content_hash, remote_url, source_path, size, uploaded_at, last_used_at) tuples, most recent first."""
+    query = "SELECT content_hash, remote_url, source_path, size, uploaded_at, last_used_at FROM uploads ORDER BY uploaded_at DESC"
+    if limit is not None:
+        return conn.execute(query + " LIMIT ?", (limit,)).fetchall()
+    return conn.execute(query).fetchall()
+
+def prune_uploads(conn, older_than_days=None, missing_sources=False):
+    """
+    Removes entries not used within older_than_days, and/or entries whose source image
+    no longer exists on disk. Returns the number of removed entries.
+    """
+    removed = 0
+    if older_than_days is not None:
+        cutoff = time.time() - older_than_days * 86400
+        removed += conn.execute("DELETE FROM uploads WHERE last_used_at < ?", (cutoff,)).rowcount
+    if missing_sources:
+        stale = [
+            (content_hash,)
+            for content_hash, source_path in conn.execute("SELECT content_hash, source_path FROM uploads")
+            if not source_path or not os.path.exists(source_path)
+        ]
+        conn.executemany("DELETE FROM uploads WHERE content_hash = ?", stale)
+        removed += len(stale)
+    conn.commit()
+    return removed
+
+def invalidate_uploads(conn, content_hashes=(), remote_urls=(), source_paths=(), invalidate_all=False):
+    """
+    Removes specific entries so the matching images are uploaded again on the next run.
+    Source paths match either the recorded path or the current content of the file.
+    Returns the number of removed entries.
+    """
+    if invalidate_all:
+        removed = conn.execute("DELETE FROM uploads").rowcount
+        conn.commit()
+        return removed
+
+    removed = 0
+    for content_hash in content_hashes:
+        removed += conn.execute("DELETE FROM uploads WHERE content_hash = ?", (content_hash,)).rowcount
+    for remote_url in remote_urls:
+        removed += conn.execute("DELETE FROM uploads WHERE remote_url = ?", (remote_url,)).rowcount
+    for source_path in source_paths:
+        source_path = os.path.abspath(source_path)
+        removed += conn.execute("DELETE FROM uploads WHERE source_path = ?", (source_path,)).rowcount
+        if os.path.isfile(source_path):
+            with open(source_path, 'rb') as f:
+                content_hash = hashlib.sha256(f.read()).hexdigest()
+            removed += conn.execute("DELETE FROM uploads WHERE content_hash = ?", (content_hash,)).rowcount
+    conn.commit()
+    return removed
+
+def main():
+    """Main function to parse arguments and run a cache maintenance command."""
+    parser = argparse.ArgumentParser(
+        description="Inspect and maintain the html2markdown image upload cache ({}).".format(UPLOAD_CACHE_NAME)
+    )
+    parser.add_argument("cache_file", help="Path to the upload cache database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("stats", help="Show the number of cached uploads.")
+
+    list_parser = subparsers.add_parser("list", help="List cached uploads, most recent first.")
+    list_parser.add_argument("--limit", type=int, default=None, help="Maximum number of entries to show.")
+
+    prune_parser = subparsers.add_parser("prune", help="Remove stale entries.")
+    prune_parser.add_argument("--older-than", type=float, default=None, metavar="DAYS",
+                              help="Remove entries not used in the last DAYS days.")
+    prune_parser.add_argument("--missing-sources", action="store_true",
+                              help="Remove entries whose source image no longer exists.")
+
+    invalidate_parser = subparsers.add_parser("invalidate", help="Remove entries so their images are uploaded again.")
+    invalidate_parser.add_argument("--hash", action="append", default=[], help="Content hash to invalidate.")
+    invalidate_parser.add_argument("--url", action="append", default=[], help="Remote URL to invalidate.")
+    invalidate_parser.add_argument("--path", action="append", default=[], help="Local image path to invalidate.")
+    invalidate_parser.add_argument("--all", action="store_true", help="Invalidate every entry.")
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.cache_file):
+        print(f"Error: Upload cache not found: {args.cache_file}", file=sys.stderr)
+        sys.exit(1)
+
+    conn = open_upload_cache(args.cache_file)
+    try:
+        if args.command == "stats":
+            count, total_size = cache_stats(conn)
+            print(f"{count} cached uploads ({total_size / (1024 * 1024):.1f} MiB of source images).")
+        elif args.command == "list":
+            for content_hash, remote_url, source_path, size, uploaded_at, last_used_at in list_uploads(conn, args.limit):
+                uploaded = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(uploaded_at))
+                print(f"{content_hash[:12]}  {uploaded}  {remote_url}  {source_path or ''}")
+        elif args.command == "prune":
+            if args.older_than is None and not args.missing_sources:
+                print("Error: prune needs --older-than and/or --missing-sources.", file=sys.stderr)
+                sys.exit(1)
+            removed = prune_uploads(conn, older_than_days=args.older_than, missing_sources=args.missing_sources)
+            print(f"Pruned {removed} entries.")
+        elif args.command == "invalidate":
+            if not (args.hash or args.url or args.path or args.all):
+                print("Error: invalidate needs --hash, --url, --path or --all.", file=sys.stderr)
+                sys.exit(1)
+            removed = invalidate_uploads(conn, args.hash, args.url, args.path, invalidate_all=args.all)
+            print(f"Invalidated {removed} entries.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import datetime
+import hashlib
+import hmac
+import http.client
+import json
+import mimetypes
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+# This module provides the in-process HTTP image uploaders used instead of uPic
+# (html2markdown.py --uploader s3|post). An uploader is any callable that takes
+# the path of a local image and returns its remote URL, or None if the upload
+# failed; html2markdown.upload_image_with_upic is the original one.
+#
+#   S3Uploader                 PUT to an S3-compatible bucket (AWS S3, R2, MinIO, OSS, COS, ...),
+#                              signed with AWS Signature Version 4
+#   MultipartPostUploader      multipart/form-data POST to an image host or your own endpoint,
+#                              the URL is read from the response
+#
+# Both keep their persistent (keep-alive) connections in a pool on the uploader, so
+# connections are reused by every upload thread and every upload stage of a run
+# (the thread pools of html2markdown.upload_images only live for one call). They
+# retry connection errors, 408/429 and 5xx responses with exponential backoff, and
+# can be limited to a number of uploads per second shared by all threads.
+# Objects are named by their SHA-256, so uploading the same image twice is harmless.
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # Seconds before the first retry, doubled for each further retry
+DEFAULT_TIMEOUT = 60  # Seconds per request
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+URL_PATTERN = re.compile(r"https?://[^\s\"'<>]+")
+
+
+class UploadError(Exception):
+    """An upload failed and may succeed when retried."""
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class HttpUploader:
+    """
+    Base class of the HTTP uploaders. Subclasses implement build_request and remote_url.
+    Calling the uploader uploads one image and returns its URL, or None on failure.
+    """
+
+    def __init__(self, max_retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, rate=None, timeout=DEFAULT_TIMEOUT):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = RateLimiter(rate) if rate else None
+        self.timeout = timeout
+        # Idle keep-alive connections by (scheme, netloc); a thread takes one for each request
+        self.idle_connections = {}
+        self.pool_lock = threading.Lock()
+
+    def build_request(self, image_path, data, digest):
+        """Returns (method, url, headers, body) for uploading an image."""
+        raise NotImplementedError
+
+    def remote_url(self, image_path, digest, request_url, response_body):
+        """Returns the public URL of an uploaded image, or None if it cannot be determined."""
+        raise NotImplementedError
+
+    def __call__(self, local_image_path):
+        try:
+            with open(local_image_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Warning: Local image not found for upload: {local_image_path} ({e})", file=sys.stderr)
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait()
+            # Requests are rebuilt for every attempt, so signatures carry a fresh timestamp
+            method, url, headers, body = self.build_request(local_image_path, data, digest)
+            try:
+                status, response_headers, response_body = self._send(method, url, headers, body)
+            except UploadError as e:
+                error, retry_after = str(e), None
+            else:
+                if 200 <= status < 300:
+                    remote_url = self.remote_url(local_image_path, digest, url, response_body)
+                    if remote_url is None:
+                        print(f"Warning: Could not find the URL of {local_image_path} in the upload response:\n"
+                              f"{response_body[:500].decode('utf-8', errors='replace')}", file=sys.stderr)
+                    return remote_url
+                error = f"HTTP {status}: {response_body[:200].decode('utf-8', errors='replace')}"
+                if status not in RETRYABLE_STATUSES:
+                    print(f"Error uploading {local_image_path}: {error}", file=sys.stderr)
+                    return None
+                retry_after = response_headers.get("Retry-After")
+
+            if attempt == self.max_retries:
+                print(f"Error uploading {local_image_path} after {attempt + 1} attempts: {error}", file=sys.stderr)
+                return None
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            print(f"Warning: Upload of {local_image_path} failed ({error}), retrying in {delay:.1f}s.", file=sys.stderr)
+            time.sleep(delay)
+        return None
+
+    def _take_connection(self, key):
+        """Returns an idle pooled connection to (scheme, netloc), or a new one."""
+        with self.pool_lock:
+            idle = self.idle_connections.get(key)
+            if idle:
+                return idle.pop()
+        scheme, netloc = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(netloc, timeout=self.timeout)
+
+    def _return_connection(self, key, connection):
+        with self.pool_lock:
+            self.idle_connections.setdefault(key, []).append(connection)
+
+    def _send(self, method, url, headers, body):
+        """Sends a request on a pooled persistent connection and returns (status, headers, body)."""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        key = (parts.scheme, parts.netloc)
+        connection = self._take_connection(key)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response_body = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            # A keep-alive connection closed by the server shows up here; the retry takes another
+            connection.close()
+            raise UploadError(f"{type(e).__name__}: {e}") from e
+        if response.will_close:
+            connection.close()
+        else:
+            self._return_connection(key, connection)
+        return response.status, response.headers, response_body
+
+
+def _content_type(image_path):
+    return mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+
+
+def _hmac_sha256(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+class S3Uploader(HttpUploader):
+    """
+    Uploads with a PUT to an S3-compatible bucket, signed with AWS Signature Version 4.
+    bucket_url is the path-style bucket URL, e.g. https://s3.us-east-1.amazonaws.com/my-bucket
+    or https://<account>.r2.cloudflarestorage.com/my-bucket. public_url_base is where the
+    objects can be read (a CDN or public bucket domain); by default the bucket URL.
+    """
+
+    def __init__(self, bucket_url, access_key, secret_key, region="us-east-1", session_token=None,
+                 key_prefix="", public_url_base=None, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket_url = bucket_url.rstrip("/")
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.session_token = session_token
+        self.key_prefix = key_prefix
+        self.public_url_base = (public_url_base or bucket_url).rstrip("/")
+
+    def object_key(self, image_path, digest):
+        return self.key_prefix + digest + os.path.splitext(image_path)[1].lower()
+
+    def build_request(self, image_path, data, digest):
+        url = f"{self.bucket_url}/{urllib.parse.quote(self.object_key(image_path, digest))}"
+        parts = urllib.parse.urlsplit(url)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date_stamp = now.strftime("%Y%m%d")
+
+        headers = {
+            "host": parts.netloc,
+            "content-type": _content_type(image_path),
+            "x-amz-content-sha256": digest,  # The key is the SHA-256 of the body already
+            "x-amz-date": amz_date,
+        }
+        if self.session_token:
+            headers["x-amz-security-token"] = self.session_token
+        signed_headers = ";".join(sorted(headers))
+        canonical_request = "\n".join([
+            "PUT",
+            parts.path,
+            "",
+            "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed_headers,
+            digest,
+        ])
+        scope = f"{date_stamp}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        signing_key = _hmac_sha256(("AWS4" + self.secret_key).encode('utf-8'), date_stamp)
+        for part in (self.region, "s3", "aws4_request"):
+            signing_key = _hmac_sha256(signing_key, part)
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers["authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_headers}, Signature={signature}")
+        return "PUT", url, headers, data
+
+    def remote_url(self, image_path, digest, request_url, response_body):
+        return f"{self.public_url_base}/{urllib.parse.quote(self.object_key(image_path, digest))}"
+
+
+class MultipartPostUploader(HttpUploader):
+    """
+    Uploads with a multipart/form-data POST, the image in the form field field_name.
+    The URL is read from the JSON response at url_field (a dotted path such as "data.url"),
+    or else is the first http(s) URL in the response, as with uPic's output.
+    """
+
+    def __init__(self, upload_url, field_name="file", url_field=None, headers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.upload_url = upload_url
+        self.field_name = field_name
+        self.url_field = url_field
+        self.headers = dict(headers or {})
+
+    def build_request(self, image_path, data, digest):
+        boundary = uuid.uuid4().hex
+        filename = digest + os.path.splitext(image_path)[1].lower()
+        body = b"".join([
+            f"--{boundary}\r\n".encode(),
+            f'Content-Disposition: form-data; name="{self.field_name}"; filename="{filename}"\r\n'.encode(),
+            f"Content-Type: {_content_type(image_path)}\r\n\r\n".encode(),
+            data,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ])
+        headers = dict(self.headers)
+        headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        return "POST", self.upload_url, headers, body
+
+    def remote_url(self, image_path, digest, request_url, response_body):
+        text = response_body.decode('utf-8', errors='replace')
+        if self.url_field:
+            try:
+                value = json.loads(text)
+                for name in self.url_field.split("."):
+                    value = value[int(name)] if isinstance(value, list) else value[name]
+            except (ValueError, KeyError, IndexError, TypeError):
+                return None
+            return value if isinstance(value, str) else None
+        match = URL_PATTERN.search(text)
+        return match.group(0) if match else None
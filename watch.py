@@ -0,0 +1,75 @@
+import os
+import time
+
+# This module implements the --watch mode of html2markdown.py and optimize_markdown.py.
+# The process stays running (with its converter and compiled rules loaded) and polls
+# the directory tree: every poll_interval seconds the size and mtime of the watched
+# files are compared with the previous poll. Once files have changed and the tree
+# has then been quiet for debounce seconds (a Wiz re-export writes many files over
+# a while), the callback is run with the changed paths. The callback runs the usual
+# incremental pass, so the manifest decides what is actually converted again.
+#
+# The baseline for the next batch is the snapshot taken before the callback ran, so
+# files changed while a pass is running (a long re-export) are picked up by the next
+# one. A tool writing into the watched tree itself (optimize_markdown.py) therefore
+# sees its own writes once more; that extra pass finds them unchanged in the manifest.
+#
+# Polling is used instead of inotify/FSEvents so it works the same on macOS,
+# Linux and network drives, without extra dependencies.
+
+DEFAULT_POLL_INTERVAL = 1.0  # Seconds between two scans of the tree
+DEFAULT_DEBOUNCE = 2.0  # Seconds without changes before a batch is processed
+
+
+def snapshot(root, suffixes, exclude_dirs=()):
+    """Returns {path: (size, mtime_ns)} of the files under root ending in one of suffixes."""
+    suffixes = tuple(suffix.lower() for suffix in suffixes)
+    excluded = {os.path.abspath(directory) for directory in exclude_dirs}
+    files = {}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue  # Removed while scanning
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.abspath(entry.path) not in excluded:
+                            stack.append(entry.path)
+                    elif entry.name.lower().endswith(suffixes):
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+    return files
+
+
+def watch_directory(root, suffixes, on_change, poll_interval=DEFAULT_POLL_INTERVAL, debounce=DEFAULT_DEBOUNCE,
+                    exclude_dirs=()):
+    """
+    Polls root until interrupted (Ctrl+C) and calls on_change(changed_paths) for every
+    debounced batch of created, modified or deleted files.
+    """
+    print(f"Watching {root} for changes (polling every {poll_interval:g}s, Ctrl+C to stop).")
+    previous = snapshot(root, suffixes, exclude_dirs)
+    changed = set()
+    last_change = 0.0
+    try:
+        while True:
+            time.sleep(poll_interval)
+            current = snapshot(root, suffixes, exclude_dirs)
+            differences = {path for path in current.keys() | previous.keys() if current.get(path) != previous.get(path)}
+            previous = current
+            if differences:
+                changed |= differences
+                last_change = time.monotonic()
+                continue
+            if changed and time.monotonic() - last_change >= debounce:
+                print(f"Detected {len(changed)} changed files.")
+                on_change(sorted(changed))
+                changed = set()
+    except KeyboardInterrupt:
+        print("Stopped watching.")
@@ -0,0 +1,303 @@
+import argparse
+import codecs
+import concurrent.futures
+import os
+import sqlite3
+import sys
+
+import html2markdown
+import optimize_markdown
+from html2markdown import (
+    CONVERTER_BACKENDS,
+    DEFAULT_CONVERTER,
+    DEFAULT_UPLOAD_WORKERS,
+    OUTPUT_DIR_NAME,
+    add_preprocess_arguments,
+    add_uploader_arguments,
+    check_preprocess_arguments,
+    create_converter,
+    create_uploader,
+    ensure_dir,
+    find_html_files,
+    find_local_images,
+    html_file_to_markdown,
+    preprocess_settings,
+    rewrite_image_links,
+    upload_image_with_upic,
+    upload_images,
+)
+from dayone_json import DayOneExportWriter
+from image_preprocess import preprocess_images
+from merge_markdown import format_entry, write_merged_entries
+from optimize_markdown import optimize_markdown_content
+from upload_cache import default_cache_path, open_upload_cache
+from wiz_index import find_note_date, load_note_dates
+
+# This script runs the whole migration in a single pass:
+# every Wiz note is converted from HTML to Markdown, its local images are uploaded,
+# the optimize_markdown rules (date format, index.md title) are applied and the
+# result is streamed into merged_result.txt, all in memory.
+# It produces the same merged_result.txt as running html2markdown.py,
+# optimize_markdown.py and merge_markdown.py in sequence, without writing and
+# re-reading the intermediate Markdown files (use --write-markdown to keep them).
+#
+# Notes are processed in batches: each batch is converted, its images are uploaded
+# together (deduplicated and cached like in html2markdown.py), and the finished
+# notes are written out before the next batch starts, so memory stays bounded.
+#
+# With --format dayone-json nothing is uploaded at all: the notes are written to a
+# Day One JSON export zip (dayone_export.zip) with their local images embedded as
+# photos, see dayone_json.py. Entry dates come from the Wiz index.db (--index-db)
+# or the diary header, like in merge_markdown.py.
+#
+# The text format uses the fixed DATE_PREFIX of merge_markdown.py for every entry,
+# unless --index-db or --header-dates asks for real dates.
+#
+# Usage: python wiz2dayone.py <path_to_wiznote_html_folder> [--jobs N] [--write-markdown]
+#                             [--format text|dayone-json] [--index-db PATH] [--header-dates]
+#                             [--converter html2text|lxml]
+
+DEFAULT_BATCH_SIZE = 200  # Notes converted and uploaded together
+DAYONE_EXPORT_NAME = "dayone_export.zip"
+
+# Converter owned by the current worker process when running with --jobs.
+_worker_converter = None
+
+
+def _init_worker(converter_backend=DEFAULT_CONVERTER):
+    """Gives each worker process its own converter instance."""
+    global _worker_converter
+    _worker_converter = create_converter(converter_backend)
+
+
+def _convert_note(input_file_path, converter):
+    """Converts one note, returning its Markdown or None if the conversion failed."""
+    try:
+        return html_file_to_markdown(input_file_path, converter)
+    except FileNotFoundError:
+        print(f"Error: Input file not found during conversion: {input_file_path}", file=sys.stderr)
+    except IOError as e:
+        print(f"Error reading file {input_file_path}: {e}", file=sys.stderr)
+    except Exception as e:
+        # Catch potential errors during html2text processing
+        print(f"Error converting file {input_file_path}: {e}", file=sys.stderr)
+    return None
+
+
+def _convert_worker(input_file_path):
+    """Converts a single note inside a worker process."""
+    return _convert_note(input_file_path, _worker_converter)
+
+
+def iter_notes(tasks, converter, executor=None, batch_size=DEFAULT_BATCH_SIZE,
+               upload_workers=DEFAULT_UPLOAD_WORKERS, upload_cache=None, upload=True, preprocess=None, prepared_images=None,
+               uploader=upload_image_with_upic):
+    """
+    Yields (input_file_path, output_file_path, markdown_content) for every note in tasks,
+    a list of (input_file_path, output_file_path) pairs, in order.
+    The Markdown has its images uploaded with uploader (unless upload is False, which
+    keeps the local image links) and the optimize_markdown rules applied.
+    With preprocess settings, each batch's images are downscaled and recompressed first;
+    the smaller copies are uploaded, or recorded in the prepared_images dict
+    (image path -> preprocessed file) when not uploading.
+    Notes that fail to convert are reported and skipped.
+    """
+    # Images shared between batches are only uploaded once
+    uploaded = {}
+    for start in range(0, len(tasks), batch_size):
+        batch = tasks[start:start + batch_size]
+        input_paths = [input_file_path for input_file_path, _ in batch]
+        if executor is not None:
+            markdown_contents = list(executor.map(_convert_worker, input_paths))
+        else:
+            markdown_contents = [_convert_note(input_file_path, converter) for input_file_path in input_paths]
+
+        remote_urls = None
+        if upload or preprocess is not None:
+            image_paths = []
+            for input_file_path, markdown_content in zip(input_paths, markdown_contents):
+                if markdown_content is not None:
+                    image_paths.extend(find_local_images(markdown_content, os.path.dirname(input_file_path)))
+            upload_paths = preprocess_images(image_paths, preprocess) if preprocess is not None and image_paths else {}
+            if not upload:
+                if prepared_images is not None:
+                    prepared_images.update(upload_paths)
+            elif image_paths:
+                uploaded_urls = upload_images([upload_paths.get(image_path, image_path) for image_path in image_paths],
+                                              max_workers=upload_workers, uploader=uploader, cache=upload_cache, uploaded=uploaded)
+                remote_urls = {image_path: uploaded_urls[upload_paths.get(image_path, image_path)] for image_path in image_paths
+                               if upload_paths.get(image_path, image_path) in uploaded_urls}
+            else:
+                remote_urls = {}
+
+        for (input_file_path, output_file_path), markdown_content in zip(batch, markdown_contents):
+            if markdown_content is None:
+                continue
+            if remote_urls is not None:
+                markdown_content = rewrite_image_links(markdown_content, os.path.dirname(input_file_path), remote_urls)
+            # The optimize rules look at the Markdown path, e.g. for the index.md title
+            markdown_content, _ = optimize_markdown_content(markdown_content, output_file_path)
+            yield input_file_path, output_file_path, markdown_content
+
+
+def write_markdown_file(output_file_path, markdown_content):
+    """Writes an intermediate Markdown file, as html2markdown.py and optimize_markdown.py would have."""
+    try:
+        ensure_dir(os.path.dirname(output_file_path))
+        with codecs.open(output_file_path, 'w', encoding='utf-8') as f:
+            f.write(markdown_content)
+    except IOError as e:
+        print(f"Error writing file {output_file_path}: {e}", file=sys.stderr)
+
+
+def write_dayone_export(notes, export_path, prepared_images=None):
+    """
+    Writes (input_file_path, markdown_content, note_date) notes to a Day One JSON export zip,
+    embedding their local images as photos, or their preprocessed copies from the
+    prepared_images dict. Returns the export path.
+    """
+    writer = DayOneExportWriter(export_path)
+    try:
+        for input_file_path, markdown_content, note_date in notes:
+            html_file_dir = os.path.dirname(input_file_path)
+            writer.write_entry(markdown_content, find_local_images(markdown_content, html_file_dir), note_date,
+                               rewrite_links=lambda content, urls: rewrite_image_links(content, html_file_dir, urls),
+                               stored_paths=prepared_images)
+    finally:
+        writer.close()
+    return export_path
+
+
+def main():
+    """Main function to parse arguments and run the single-pass pipeline."""
+    parser = argparse.ArgumentParser(
+        description="Convert a Wiz HTML export straight into a Day One plain text import file, in a single pass."
+    )
+    parser.add_argument("input_path", help="Path to the Wiz HTML export directory.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used for HTML conversion (default: 1).")
+    parser.add_argument("--converter", choices=CONVERTER_BACKENDS, default=DEFAULT_CONVERTER,
+                        help=f"HTML to Markdown backend (default: {DEFAULT_CONVERTER}), see html2markdown.py.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of notes converted and uploaded together (default: {DEFAULT_BATCH_SIZE}).")
+    parser.add_argument("--upload-workers", type=int, default=DEFAULT_UPLOAD_WORKERS,
+                        help=f"Number of concurrent image uploads (default: {DEFAULT_UPLOAD_WORKERS}).")
+    add_uploader_arguments(parser)
+    add_preprocess_arguments(parser)
+    parser.add_argument("--write-markdown", action="store_true",
+                        help=f"Also write the optimized Markdown files to the '{OUTPUT_DIR_NAME}' directory.")
+    parser.add_argument("--format", choices=("text", "dayone-json"), default="text",
+                        help="Output a Day One plain text import file (default), or a Day One JSON export zip "
+                             f"('{DAYONE_EXPORT_NAME}') with the images embedded instead of uploaded.")
+    parser.add_argument("--index-db", default=None,
+                        help="Wiz index.db to take each note's real date from (see merge_markdown.py).")
+    parser.add_argument("--date-field", choices=("created", "modified"), default="created",
+                        help="Which index.db date to use (default: created).")
+    parser.add_argument("--header-dates", action="store_true",
+                        help="Date text entries by their 'My Diary' DD/MM header, without --index-db "
+                             "(always done for notes missing from index.db, and with --format dayone-json).")
+    parser.add_argument("--max-bytes", type=int, default=None,
+                        help="Split the output into numbered parts of at most this many bytes.")
+    parser.add_argument("--max-entries", type=int, default=None,
+                        help="Split the output into numbered parts of at most this many entries.")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Do not print per-file progress messages (warnings and errors are still printed).")
+    args = parser.parse_args()
+
+    html2markdown.VERBOSE = optimize_markdown.VERBOSE = not args.quiet
+
+    for name, value in (("--jobs", args.jobs), ("--batch-size", args.batch_size), ("--upload-workers", args.upload_workers),
+                        ("--max-bytes", args.max_bytes), ("--max-entries", args.max_entries)):
+        if value is not None and value < 1:
+            print(f"Error: {name} must be at least 1, got {value}", file=sys.stderr)
+            sys.exit(1)
+    try:
+        check_preprocess_arguments(args)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.format == "dayone-json" and (args.max_bytes or args.max_entries):
+        print("Error: --max-bytes and --max-entries only apply to the text format", file=sys.stderr)
+        sys.exit(1)
+
+    input_path = os.path.abspath(args.input_path)
+    if not os.path.isdir(input_path):
+        print(f"Error: Input path is not a valid directory: {input_path}", file=sys.stderr)
+        sys.exit(1)
+
+    # Same output location as html2markdown.py + merge_markdown.py
+    output_dir_base = os.path.join(input_path, OUTPUT_DIR_NAME)
+    ensure_dir(output_dir_base)
+    print(f"Output will be saved in: {output_dir_base}")
+
+    tasks = find_html_files(input_path, output_dir_base)
+    print(f"Found {len(tasks)} notes in: {input_path}")
+
+    note_dates = None
+    if args.index_db:
+        try:
+            note_dates = load_note_dates(args.index_db, args.date_field)
+        except sqlite3.Error as e:
+            print(f"Error reading Wiz index {args.index_db}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        converter = create_converter(args.converter)
+        uploader = create_uploader(args)
+    except (ImportError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    upload = args.format == "text"
+    upload_cache = None
+    if upload and not args.no_upload_cache:
+        upload_cache = open_upload_cache(args.upload_cache or default_cache_path(output_dir_base))
+    executor = None
+    if args.jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                                          initargs=(args.converter,))
+
+    preprocess = preprocess_settings(args, output_dir_base)
+    prepared_images = {}
+    converted_count = 0
+    # The text output keeps the fixed date of merge_markdown.py unless real dates are asked for
+    use_note_dates = args.index_db or args.header_dates or args.format == "dayone-json"
+
+    def notes():
+        """Yields (input_file_path, markdown_content, note_date) for every converted note."""
+        nonlocal converted_count
+        converted = iter_notes(tasks, converter if executor is None else None, executor=executor,
+                               batch_size=args.batch_size, upload_workers=args.upload_workers, upload_cache=upload_cache,
+                               upload=upload, preprocess=preprocess, prepared_images=prepared_images, uploader=uploader)
+        for input_file_path, output_file_path, markdown_content in converted:
+            if args.write_markdown:
+                write_markdown_file(output_file_path, markdown_content)
+            converted_count += 1
+            relative_path = os.path.relpath(output_file_path, output_dir_base)
+            note_date = find_note_date(note_dates, relative_path, markdown_content) if use_note_dates else None
+            yield input_file_path, markdown_content, note_date
+
+    try:
+        if args.format == "dayone-json":
+            output_paths = [write_dayone_export(notes(), os.path.join(output_dir_base, DAYONE_EXPORT_NAME), prepared_images)]
+        else:
+            entries = (format_entry(markdown_content, note_date) for _, markdown_content, note_date in notes())
+            output_paths = write_merged_entries(entries, output_dir_base, max_bytes=args.max_bytes, max_entries=args.max_entries)
+    except Exception as e:
+        print(f"Error writing merged output in {output_dir_base}: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if upload_cache is not None:
+            upload_cache.close()
+
+    print(f"Converted {converted_count} of {len(tasks)} notes.")
+    if len(output_paths) == 1:
+        print(f"Successfully merged notes into {output_paths[0]}")
+    else:
+        print(f"Successfully merged notes into {len(output_paths)} files: {output_paths[0]} ... {output_paths[-1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import datetime
+import os
+import re
+import sqlite3
+import sys
+
+from text_reader import read_text_head
+
+# This module provides the real dates of Wiz notes for merge_markdown.py.
+# The Wiz client keeps every note in the WIZ_DOCUMENT table of its index.db
+# (~/.wiznote/<user>/data/index.db), with the folder (DOCUMENT_LOCATION, e.g.
+# "/My Notes/Travel/"), the title and the created/modified timestamps.
+# wiz-export writes each note to <location>/<title>/index.html, so a Markdown file
+# is matched to its note by that path, or by its title when the title is unique.
+#
+# All rows are loaded with a single query into in-memory dicts, so looking up the
+# date of a note during the merge is O(1) and never touches the database again.
+# Notes that are not found fall back to the DD/MM/weekday header produced by
+# optimize_markdown.optimize_date.
+
+WIZ_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+# Header written by optimize_markdown.optimize_date, e.g. "12/05/星期三", optionally after an index.md title
+DIARY_HEADER_PATTERN = re.compile(r"\A\s*(?:#[^\n]*\n\s*)?(\d{1,2})/(\d{1,2})/([^\n]*)")
+YEAR_PATTERN = re.compile(r"(?<!\d)(19\d{2}|20\d{2})(?!\d)")
+
+WEEKDAY_NAMES = {
+    0: ("星期一", "周一", "monday", "mon"),
+    1: ("星期二", "周二", "tuesday", "tue"),
+    2: ("星期三", "周三", "wednesday", "wed"),
+    3: ("星期四", "周四", "thursday", "thu"),
+    4: ("星期五", "周五", "friday", "fri"),
+    5: ("星期六", "周六", "saturday", "sat"),
+    6: ("星期日", "星期天", "周日", "周天", "sunday", "sun"),
+}
+
+# Number of bytes read from a note to find its diary header
+HEADER_READ_SIZE = 4096
+
+
+def _parse_wiz_date(value):
+    if not value:
+        return None
+    for date_format in WIZ_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def _note_key(*parts):
+    """Normalizes a folder/title path into a lookup key."""
+    return "/".join(part.strip("/") for part in parts if part.strip("/")).casefold()
+
+
+def load_note_dates(index_db_path, date_field="created"):
+    """
+    Loads the dates of all notes from a Wiz index.db in one query.
+    Returns a dict with 'by_path' (location/title key -> datetime) and
+    'by_title' (title key -> datetime, or None when several notes share the title).
+    """
+    column = "DT_CREATED" if date_field == "created" else "DT_MODIFIED"
+    conn = sqlite3.connect(f"file:{index_db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(f"SELECT DOCUMENT_LOCATION, DOCUMENT_TITLE, {column} FROM WIZ_DOCUMENT").fetchall()
+    finally:
+        conn.close()
+
+    by_path = {}
+    by_title = {}
+    for location, title, value in rows:
+        note_date = _parse_wiz_date(value)
+        if note_date is None or not title:
+            continue
+        by_path[_note_key(location or "", title)] = note_date
+        title_key = _note_key(title)
+        # A title shared by several notes cannot identify a note on its own
+        by_title[title_key] = None if title_key in by_title else note_date
+    print(f"Loaded dates of {len(by_path)} notes from {index_db_path}")
+    return {"by_path": by_path, "by_title": by_title}
+
+
+def lookup_note_date(note_dates, relative_markdown_path):
+    """
+    Returns the date of the note a Markdown file (path relative to the merged directory)
+    was converted from, or None if it is not in the index.
+    """
+    directory, filename = os.path.split(relative_markdown_path.replace(os.sep, "/"))
+    name = os.path.splitext(filename)[0]
+    if name.lower() == "index" and directory:
+        # <location>/<title>/index.md
+        location, title = os.path.split(directory)
+    else:
+        location, title = directory, name
+
+    candidates = [title]
+    # Wiz titles often keep the extension of the original file, e.g. "notes.md"
+    stripped_title = os.path.splitext(title)[0]
+    if stripped_title != title:
+        candidates.append(stripped_title)
+    for candidate in candidates:
+        note_date = note_dates["by_path"].get(_note_key(location, candidate))
+        if note_date is not None:
+            return note_date
+    for candidate in candidates:
+        note_date = note_dates["by_title"].get(_note_key(candidate))
+        if note_date is not None:
+            return note_date
+    return None
+
+
+def _parse_weekday(text):
+    text = text.strip().casefold()
+    for weekday, names in WEEKDAY_NAMES.items():
+        if any(text.startswith(name) for name in names):
+            return weekday
+    return None
+
+
+def infer_year(day, month, weekday, latest_year):
+    """Returns the most recent year up to latest_year in which day/month fell on weekday, or None."""
+    for year in range(latest_year, latest_year - 28, -1):
+        try:
+            if datetime.date(year, month, day).weekday() == weekday:
+                return year
+        except ValueError:
+            continue  # 29/02 outside a leap year
+    return None
+
+
+def date_from_diary_header(content, relative_markdown_path, latest_year=None):
+    """
+    Returns the date given by the DD/MM/weekday diary header at the start of a note, or None.
+    The year comes from the note's path (e.g. "My Diary/2019/...") if present,
+    otherwise from the most recent year in which that day fell on the given weekday.
+    """
+    match = DIARY_HEADER_PATTERN.match(content)
+    if not match:
+        return None
+    day, month = int(match.group(1)), int(match.group(2))
+
+    year_match = YEAR_PATTERN.search(relative_markdown_path)
+    if year_match:
+        year = int(year_match.group(1))
+    else:
+        weekday = _parse_weekday(match.group(3))
+        if weekday is None:
+            return None
+        year = infer_year(day, month, weekday, latest_year or datetime.date.today().year)
+        if year is None:
+            return None
+    try:
+        return datetime.datetime(year, month, day)
+    except ValueError:
+        return None
+
+
+def find_note_date(note_dates, relative_markdown_path, content):
+    """Returns the date of a note from the index (if given), otherwise from its diary header, or None."""
+    note_date = lookup_note_date(note_dates, relative_markdown_path) if note_dates else None
+    return note_date or date_from_diary_header(content, relative_markdown_path)
+
+
+def read_note_header(file_path):
+    """Reads the beginning of a note, enough to find its diary header."""
+    try:
+        return read_text_head(file_path, HEADER_READ_SIZE)
+    except IOError as e:
+        print(f"Warning: Could not read {file_path}: {e}", file=sys.stderr)
+        return ""